@@ -9,6 +9,7 @@ Available functions:
     calculate indices  : NDVI, GNDVI, NDWI, NDMI
     geological_indices : CMR, FMR, IOR
     tasseled_cap       : Brightness, Greenness, Wetness
+    upsample_native_bands
 
 """
 #Load modules
@@ -16,7 +17,7 @@ import dask
 import numpy as np
 import xarray as xr
 
-def calculate_indices(ds, index):
+def calculate_indices(ds, index, dtype='float32'):
 
     """
     Available indices are all calculated within the same function. If an
@@ -35,12 +36,30 @@ def calculate_indices(ds, index):
     inputs:
     ds - dataset containing the bands needed for index calculation
     index - str of the index to be calculated
+    dtype - data type of the output: 'float32' (default) or 'float64' to calculate and return
+            floats of that precision, or 'int16' to calculate in float32 and return the index
+            multiplied by 10000 as integers with NaN stored as -32768 (see the `scale_factor`
+            and `nodata` attributes of the output). 'int16' suits indices between -1.0 and 1.0
 
     outputs:
     indexout - result of the index calculation
     
     """
 
+    # Bands read by each index
+    index_bands = {'NDWI-nir': ['green', 'nir'],
+                   'ModifiedNDWI': ['green', 'swir1'],
+                   'NDVI': ['nir', 'red'],
+                   'GNDVI': ['nir', 'green'],
+                   'NDMI-green': ['swir1', 'green'],
+                   'NDMI-nir': ['nir', 'swir1']}
+
+    # Upsample any bands loaded at their native resolution so all bands share the same grid,
+    # and convert the bands the index reads to the precision the index is calculated in (with
+    # any nodata values set to NaN)
+    ds = upsample_native_bands(ds)
+    ds = _index_calc_dtype(ds, dtype, index_bands.get(index, []))
+
     if index == 'NDWI-nir':
         print('The formula we are using is (green - nir)/(green + nir)')
         try:
@@ -120,13 +139,13 @@ def calculate_indices(ds, index):
                except:
                    print('Error! NDMI-nir requires nir and swir1 bands')
     try:
-        return indexout
-    except:
+        return _index_output_dtype(indexout, dtype)
+    except NameError:
         print('Hmmmmm. I don\'t recognise that index. '
               'Options I currently have are NDVI, GNDVI, NDMI-green, NDMI-nir, NDWI and ModifiedNDWI.')
 
 
-def geological_indices(ds, index):
+def geological_indices(ds, index, dtype='float32'):
     """
     Available indices are all calculated within the same function. If an
     index is requested that is not coded in the function, an error is
@@ -143,6 +162,10 @@ def geological_indices(ds, index):
     inputs:
     ds - dataset containing the bands needed for index calculation
     index - str of the index to be calculated
+    dtype - data type of the output: 'float32' (default) or 'float64' to calculate and return
+            floats of that precision, or 'int16' to calculate in float32 and return the index
+            multiplied by 10000 as integers with NaN stored as -32768 (see the `scale_factor`
+            and `nodata` attributes of the output). 'int16' suits indices between -1.0 and 1.0
 
     outputs:
     indexout - result of the index calculation
@@ -150,6 +173,17 @@ def geological_indices(ds, index):
     Reference: http://www.harrisgeospatial.com/docs/BackgroundGeologyIndices.html
     """
 
+    # Bands read by each index
+    index_bands = {'CMR': ['swir1', 'swir2'],
+                   'FMR': ['swir1', 'nir'],
+                   'IOR': ['red', 'blue']}
+
+    # Upsample any bands loaded at their native resolution so all bands share the same grid,
+    # and convert the bands the index reads to the precision the index is calculated in (with
+    # any nodata values set to NaN)
+    ds = upsample_native_bands(ds)
+    ds = _index_calc_dtype(ds, dtype, index_bands.get(index, []))
+
     if index == 'CMR':
         print('The formula we are using for Clay Minerals Ratio is (swir1 / swir2)')
         try:
@@ -187,13 +221,13 @@ def geological_indices(ds, index):
                 except:
                     print('Error! Iron Oxide Ratio requires red and blue bands')
     try:
-        return indexout
-    except:
+        return _index_output_dtype(indexout, dtype)
+    except NameError:
         print('Hmmmmm. I don\'t recognise that index. '
               'Options I currently have are CMR, FMR and IOR.')
         
 def tasseled_cap(sensor_data, tc_bands=['greenness', 'brightness', 'wetness'],
-                 drop=True):
+                 drop=True, dtype='float32'):
     """   
     Computes tasseled cap wetness, greenness and brightness bands from a six
     band xarray dataset, and returns a new xarray dataset with old bands
@@ -202,52 +236,168 @@ def tasseled_cap(sensor_data, tc_bands=['greenness', 'brightness', 'wetness'],
     Coefficients are from Crist and Cicone 1985 "A TM Tasseled Cap equivalent 
     transformation for reflectance factor data"
     https://doi.org/10.1016/0034-4257(85)90102-6
+
+    The six bands are stacked once and all requested tasseled cap bands are 
+    computed together as a single matrix product, chunk by chunk if the input 
+    is a dask dataset. The input dataset is not copied.
     
-    Last modified: June 2018
+    Last modified: October 2026
     Authors: Robbi Bishop-Taylor, Bex Dunn
     
     :attr sensor_data: input xarray dataset with six Landsat bands
     :attr tc_bands: list of tasseled cap bands to compute
     (valid options: 'wetness', 'greenness','brightness')
     :attr drop: if 'drop = False', return all original Landsat bands
+    :attr dtype: data type the tasseled cap bands are computed and returned in
+    (valid options: 'float32' (default), 'float64')
     :returns: xarray dataset with newly computed tasseled cap bands
     """
 
-    # Copy input dataset
-    output_array = sensor_data.copy(deep=True)
+    # Upsample any bands loaded at their native resolution so all bands share the same grid
+    sensor_data = upsample_native_bands(sensor_data)
 
-    # Coefficients for each tasseled cap band
-    wetness_coeff = {'blue': 0.0315, 'green': 0.2021, 'red': 0.3102,
-                     'nir': 0.1594, 'swir1': -0.6806, 'swir2': -0.6109}
-    
-    greenness_coeff = {'blue': -0.1603, 'green': -0.2819, 'red': -0.4934,
-                       'nir': 0.7940, 'swir1': -0.0002, 'swir2': -0.1446}
-    
-    brightness_coeff = {'blue': 0.2043, 'green': 0.4158, 'red': 0.5524,
-                        'nir': 0.5741, 'swir1': 0.3124, 'swir2': 0.2303}
-    
-    # Dict to use correct coefficients for each tasseled cap band
-    analysis_coefficient = {'wetness': wetness_coeff,
-                            'greenness': greenness_coeff,
-                            'brightness': brightness_coeff}
-
-    # For each band, compute tasseled cap band and add to output dataset
-    for tc_band in tc_bands:
-        # Create xarray of coefficient values used to multiply each band of input
-        coeff = xr.Dataset(analysis_coefficient[tc_band])
-        sensor_coeff = sensor_data * coeff
-
-        # Sum all bands
-        output_array[tc_band] = sensor_coeff.blue + sensor_coeff.green + \
-                                sensor_coeff.red + sensor_coeff.nir + \
-                                sensor_coeff.swir1 + sensor_coeff.swir2
+    # Coefficients for each tasseled cap band, in the order of `bands`
+    bands = ['blue', 'green', 'red', 'nir', 'swir1', 'swir2']
+    analysis_coefficient = {'wetness': [0.0315, 0.2021, 0.3102, 0.1594, -0.6806, -0.6109],
+                            'greenness': [-0.1603, -0.2819, -0.4934, 0.7940, -0.0002, -0.1446],
+                            'brightness': [0.2043, 0.4158, 0.5524, 0.5741, 0.3124, 0.2303]}
+
+    invalid_bands = [tc_band for tc_band in tc_bands if tc_band not in analysis_coefficient]
+    if invalid_bands:
+        raise ValueError("Invalid tasseled cap band(s) {}. Valid options are 'wetness', "
+                         "'greenness' and 'brightness'".format(', '.join(invalid_bands)))
+    if dtype not in ('float32', 'float64'):
+        raise ValueError("'{}' is not a valid option for `dtype`. Please specify either "
+                         "'float32' or 'float64'".format(dtype))
+
+    # Nodata values in integer bands (e.g. data loaded using `preserve_dtype=True`) are set to
+    # NaN so they are not used as reflectances
+    nodata_values = [sensor_data[band].attrs.get('nodata')
+                     if np.issubdtype(sensor_data[band].dtype, np.integer) else None
+                     for band in bands]
+
+    # Compute all requested tasseled cap bands together from the stacked input bands.
+    # Results are returned with an extra `tc_band` dimension
+    coefficients = np.array([analysis_coefficient[tc_band] for tc_band in tc_bands], dtype=dtype)
+    tc_arrays = xr.apply_ufunc(_tasseled_cap_arrays, *[sensor_data[band] for band in bands],
+                               kwargs=dict(coefficients=coefficients, nodata_values=nodata_values),
+                               output_core_dims=[['tc_band']],
+                               dask='parallelized',
+                               output_dtypes=[coefficients.dtype],
+                               output_sizes={'tc_band': len(tc_bands)})
 
     # If drop = True, remove original bands
     if drop:
-        bands_to_drop = list(sensor_data.data_vars)
-        output_array = output_array.drop(bands_to_drop)
+        output_array = sensor_data.drop(list(sensor_data.data_vars))
+    else:
+        output_array = sensor_data.copy()
+
+    for i, tc_band in enumerate(tc_bands):
+        output_array[tc_band] = tc_arrays.isel(tc_band=i)
 
     return output_array
+
+
+def upsample_native_bands(ds):
+
+    """
+    Upsamples bands loaded at their native resolution by
+    `DEADataHandling.load_clearsentinel2(native_resolution=True)` (i.e. bands with spatial
+    dimensions named with a resolution suffix, such as `x_20m` and `y_20m`) onto the pixel grid
+    of the other bands in the dataset using nearest neighbour resampling, so that all bands can
+    be combined (e.g. to calculate a band index). Lazily loaded (dask) bands are upsampled
+    lazily, so only bands that are actually used are upsampled in memory; bands already in
+    memory are upsampled immediately.
+
+    `native_resolution` is only available in `load_clearsentinel2`, and the sandbox
+    `dea_bandindices.calculate_indices` does not upsample bands, so native resolution bands
+    must be upsampled with this function before using it.
+
+    inputs:
+    ds - dataset returned by `load_clearsentinel2(native_resolution=True)`
+
+    outputs:
+    upsampled_ds - dataset with all bands on the same pixel grid. Datasets without native
+                   resolution bands are returned unchanged
+
+    """
+
+    upsampled, native_dims = {}, set()
+    for name, var in ds.data_vars.items():
+
+        # Identify dimensions like `x_20m` that have a full resolution equivalent (e.g. `x`) in the dataset
+        renames = {dim: dim.rsplit('_', 1)[0] for dim in var.dims
+                   if dim.endswith('m') and dim.rsplit('_', 1)[0] in ds.dims}
+        if renames:
+            upsampled[name] = (var.rename(renames)
+                               .reindex({dim: ds[dim] for dim in renames.values()}, method='nearest'))
+            native_dims.update(renames)
+
+    if not upsampled:
+        return ds
+
+    return ds.drop(list(upsampled) + [dim for dim in native_dims if dim in ds.coords]).assign(**upsampled)
+
+
+def _index_calc_dtype(ds, dtype, bands):
+    """
+    Helper function that returns only the numeric `bands` in `ds` that an index reads (under
+    any of their Landsat or Sentinel 2 names, e.g. 'nir', 'nbart_nir_1' or 'nbar_nir_1'),
+    converted to the float precision an index with output `dtype` is calculated in: float64
+    if `dtype` is 'float64', otherwise float32. Nodata values in integer bands (e.g. data
+    loaded using `preserve_dtype=True`) are set to NaN so they are not used as reflectances.
+    """
+
+    if dtype not in ('float32', 'float64', 'int16'):
+        raise ValueError("'{}' is not a valid option for `dtype`. Please specify either "
+                         "'float32', 'float64' or 'int16'".format(dtype))
+
+    suffixes = {'nir': 'nir_1', 'swir1': 'swir_1', 'swir2': 'swir_2'}
+    band_names = [name for band in bands
+                  for name in (band, 'nbart_' + suffixes.get(band, band),
+                               'nbar_' + suffixes.get(band, band))
+                  if name in ds.data_vars and np.issubdtype(ds[name].dtype, np.number)]
+
+    calc_ds = ds[band_names].astype('float64' if dtype == 'float64' else 'float32', copy=False)
+    for name in band_names:
+        if 'nodata' in ds[name].attrs and np.issubdtype(ds[name].dtype, np.integer):
+            calc_ds[name] = calc_ds[name].where(ds[name] != ds[name].attrs['nodata'])
+
+    return calc_ds
+
+
+def _index_output_dtype(indexout, dtype):
+    """
+    Helper function that converts a calculated index to the output `dtype`. For 'int16', the
+    index is multiplied by 10000 and rounded (clipped to the int16 range), with NaN stored
+    as -32768, and `scale_factor` and `nodata` attributes are set to match.
+    """
+
+    if dtype != 'int16':
+        return indexout.astype(dtype, copy=False)
+
+    scaled = (indexout * 10000).round().clip(-32767, 32767).fillna(-32768).astype('int16')
+    scaled.attrs.update(scale_factor=0.0001, nodata=-32768)
+
+    return scaled
+
+
+def _tasseled_cap_arrays(*band_arrays, coefficients, nodata_values):
+    """
+    Helper function for `tasseled_cap` that stacks numpy arrays of the six input bands (setting
+    any `nodata_values` to NaN) and applies the tasseled cap `coefficients` matrix (one row per
+    tasseled cap band) as a single tensordot, returning an array with the tasseled cap bands
+    stacked along a new last axis.
+    """
+
+    stacked = np.stack([band_array.astype(coefficients.dtype, copy=False)
+                        for band_array in band_arrays])
+    for stacked_band, band_array, nodata in zip(stacked, band_arrays, nodata_values):
+        if nodata is not None:
+            stacked_band[band_array == nodata] = np.nan
+    tc_arrays = np.tensordot(coefficients, stacked, axes=1)
+
+    return np.moveaxis(tc_arrays, 0, -1)
        
 
 # If the module is being run, not being imported! 
@@ -8,6 +8,8 @@ Available functions:
     load_sentinel
     load_clearlandsat (also does fractional cover)
     load_clearsentinel2
+    upsample_native_bands (from BandIndices.py)
+    make_mask_lut
     dataset_to_geotiff
     open_polygon_from_shapefile
     write_your_netcdf
@@ -21,6 +23,7 @@ Authors: Claire Krause, Robbi Bishop-Taylor, Bex Dunn, Chad Burton
 # Load modules
 from datacube.helpers import ga_pq_fuser
 from datacube.storage import masking
+from datacube.api.query import solar_day, query_group_by, SPATIAL_KEYS, CRS_KEYS
 import gdal
 import numpy as np
 import xarray as xr
@@ -38,11 +41,29 @@ try:
 except ImportError:
     from datacube.drivers.netcdf import write_dataset_to_netcdf
     
+import os
+import json
+import sys
+import hashlib
 import warnings
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# The resource module (used to report peak memory use) is not available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
 warnings.simplefilter('ignore', FutureWarning)
 
+# Import external functions from dea-notebooks
+sys.path.append(os.path.expanduser('~/dea-notebooks/10_Scripts/'))
+from BandIndices import upsample_native_bands
+
     
-def load_nbarx(dc, sensor, query, product='nbart', bands_of_interest='', filter_pq=True):
+def load_nbarx(dc, sensor, query, product='nbart', bands_of_interest='', filter_pq=True,
+               pq_first=False, masked_prop=0.0):
     """
     Loads NBAR (Nadir BRDF Adjusted Reflectance) or NBAR-T (terrain corrected NBAR) data for a
     sensor, masks using pixel quality (PQ), then optionally filters out terrain -999s (for NBAR-T).
@@ -63,6 +84,11 @@ def load_nbarx(dc, sensor, query, product='nbart', bands_of_interest='', filter_
     bands_of_interest - List of strings containing the bands to be read in; defaults to all bands,
                         options include 'red', 'green', 'blue', 'nir', 'swir1', 'swir2'
     filter_pq - boolean. Will filter clouds and saturated pixels using PQ unless set to False
+    pq_first - boolean. If True (and filter_pq is True), PQ is read first and spectral bands are only
+               read for timesteps with at least `masked_prop` proportion of clear pixels. This avoids
+               reading NBAR/NBAR-T data for cloudy timesteps that would otherwise be masked out
+    masked_prop - float. Minimum proportion of clear pixels required for a timestep to be loaded when
+                  pq_first=True. Defaults to 0.0 (all timesteps with PQ data are loaded)
 
 
     outputs
@@ -73,6 +99,50 @@ def load_nbarx(dc, sensor, query, product='nbart', bands_of_interest='', filter_
 
     product_name = '{}_{}_albers'.format(sensor, product)
     mask_product = '{}_{}_albers'.format(sensor, 'pq')
+    good_quality = None
+
+    # If PQ-first loading is enabled, read PQ before any spectral data and keep
+    # only the timesteps that contain enough clear pixels
+    if filter_pq and pq_first:
+
+        print('Loading {}'.format(mask_product))
+        pq_datasets = _find_datasets(dc, mask_product, query)
+        sensor_pq = dc.load(product=mask_product, fuse_func=ga_pq_fuser,
+                            group_by='solar_day', **dict(query, datasets=pq_datasets))
+
+        if not sensor_pq.variables:
+            print('Failed to load {}'.format(mask_product))
+            return None, None, None
+
+        print('Generating mask {}'.format(mask_product))
+        good_quality = make_mask_lut(sensor_pq.pixelquality,
+                                     cloud_acca='no_cloud',
+                                     cloud_shadow_acca='no_cloud_shadow',
+                                     cloud_shadow_fmask='no_cloud_shadow',
+                                     cloud_fmask='no_cloud',
+                                     blue_saturated=False,
+                                     green_saturated=False,
+                                     red_saturated=False,
+                                     nir_saturated=False,
+                                     swir1_saturated=False,
+                                     swir2_saturated=False,
+                                     contiguous=True)
+
+        # Proportion of clear pixels per timestep, summing over each spatial axis in turn
+        # so that this also works with lat-lon dimensions
+        clear_prop = good_quality.sum(axis=1).sum(axis=1) / (good_quality.shape[1] * good_quality.shape[2])
+        good_quality = good_quality.sel(time=clear_prop >= masked_prop)
+        print('    {} of {} timesteps pass clear threshold'.format(len(good_quality.time),
+                                                                   len(clear_prop.time)))
+
+        # Restrict the spectral load to datasets from the clear timesteps only
+        clear_days = _solar_days(dc, pq_datasets, good_quality.time.values)
+        clear_datasets = _find_datasets(dc, product_name, query, solar_days=clear_days)
+        if not clear_datasets:
+            print('Failed to load {}; no clear timesteps for query'.format(product_name))
+            return None, None, None
+        query = dict(query, datasets=clear_datasets)
+
     print('Loading {}'.format(product_name))
 
     # If bands of interest are given, assign measurements in dc.load call
@@ -93,8 +163,18 @@ def load_nbarx(dc, sensor, query, product='nbart', bands_of_interest='', filter_
         affine = ds.affine
         print('Loaded {}'.format(product_name))
 
-        # If pixel quality filtering is enabled, extract PQ data to use as mask
-        if filter_pq:
+        # If pixel quality filtering is enabled, use the PQ mask from the first pass if
+        # available, otherwise extract PQ data to use as mask
+        if filter_pq and good_quality is not None:
+
+            print('Applying mask {}'.format(mask_product))
+            ds = ds.where(good_quality.sel(time=ds.time))
+
+            ds.attrs['crs'] = crs
+            ds.attrs['affine'] = affine
+            ds = masking.mask_invalid_data(ds)
+
+        elif filter_pq:
 
             sensor_pq = dc.load(product=mask_product, fuse_func=ga_pq_fuser,
                                 group_by='solar_day', **query)
@@ -102,18 +182,18 @@ def load_nbarx(dc, sensor, query, product='nbart', bands_of_interest='', filter_
             # If PQ call returns data, use to mask input data
             if sensor_pq.variables:
                 print('Generating mask {}'.format(mask_product))
-                good_quality = masking.make_mask(sensor_pq.pixelquality,
-                                                 cloud_acca='no_cloud',
-                                                 cloud_shadow_acca='no_cloud_shadow',
-                                                 cloud_shadow_fmask='no_cloud_shadow',
-                                                 cloud_fmask='no_cloud',
-                                                 blue_saturated=False,
-                                                 green_saturated=False,
-                                                 red_saturated=False,
-                                                 nir_saturated=False,
-                                                 swir1_saturated=False,
-                                                 swir2_saturated=False,
-                                                 contiguous=True)
+                good_quality = make_mask_lut(sensor_pq.pixelquality,
+                                             cloud_acca='no_cloud',
+                                             cloud_shadow_acca='no_cloud_shadow',
+                                             cloud_shadow_fmask='no_cloud_shadow',
+                                             cloud_fmask='no_cloud',
+                                             blue_saturated=False,
+                                             green_saturated=False,
+                                             red_saturated=False,
+                                             nir_saturated=False,
+                                             swir1_saturated=False,
+                                             swir2_saturated=False,
+                                             contiguous=True)
 
                 # Apply mask to preserve only good data
                 ds = ds.where(good_quality)
@@ -133,7 +213,8 @@ def load_nbarx(dc, sensor, query, product='nbart', bands_of_interest='', filter_
         return None, None, None
 
 
-def load_sentinel(dc, product, query, filter_cloud=True, **bands_of_interest):
+def load_sentinel(dc, product, query, filter_cloud=True, pq_first=False, masked_prop=0.0,
+                  **bands_of_interest):
     '''loads a sentinel granule product and masks using pq
 
     Last modified: March 2018
@@ -152,6 +233,11 @@ def load_sentinel(dc, product, query, filter_cloud=True, **bands_of_interest):
 
     optional:
     bands_of_interest - List of strings containing the bands to be read in.
+    pq_first - boolean. If True (and filter_cloud is True), fmask is read first and the remaining
+               bands are only read for timesteps with at least `masked_prop` proportion of clear
+               pixels, avoiding reads of cloudy timesteps that would otherwise be masked out
+    masked_prop - float. Minimum proportion of clear pixels required for a timestep to be loaded when
+                  pq_first=True. Defaults to 0.0 (all timesteps are loaded)
 
     outputs
     ds - Extracted and pq filtered dataset
@@ -159,6 +245,35 @@ def load_sentinel(dc, product, query, filter_cloud=True, **bands_of_interest):
     affine - ds affine
     '''
     dataset = []
+    clear_pixels = None
+
+    # If PQ-first loading is enabled, read fmask before any other bands and keep
+    # only the timesteps that contain enough clear pixels
+    if filter_cloud and pq_first:
+        print('loading {} fmask'.format(product))
+        fmask_datasets = _find_datasets(dc, product, query)
+        fmask = dc.load(product=product, measurements=['fmask'],
+                        group_by='solar_day', **dict(query, datasets=fmask_datasets))
+        if not fmask.variables:
+            print('did not load {}'.format(product))
+            return None
+
+        print('making mask')
+        clear_pixels = np.logical_and(np.logical_and(fmask.fmask != 0, fmask.fmask != 2),
+                                      fmask.fmask != 3)
+        clear_prop = clear_pixels.sum(axis=1).sum(axis=1) / (clear_pixels.shape[1] * clear_pixels.shape[2])
+        clear_pixels = clear_pixels.sel(time=clear_prop >= masked_prop)
+        print('    {} of {} timesteps pass clear threshold'.format(len(clear_pixels.time),
+                                                                   len(clear_prop.time)))
+
+        # Restrict the band load to datasets from the clear timesteps only
+        clear_days = _solar_days(dc, fmask_datasets, clear_pixels.time.values)
+        clear_datasets = [dataset for dataset in fmask_datasets if solar_day(dataset) in clear_days]
+        if not clear_datasets:
+            print('did not load {}; no clear timesteps for query'.format(product))
+            return None
+        query = dict(query, datasets=clear_datasets)
+
     print('loading {}'.format(product))
     if bands_of_interest:
         ds = dc.load(product=product, measurements=bands_of_interest,
@@ -169,7 +284,10 @@ def load_sentinel(dc, product, query, filter_cloud=True, **bands_of_interest):
         crs = ds.crs
         affine = ds.affine
         print('loaded {}'.format(product))
-        if filter_cloud:
+        if filter_cloud and clear_pixels is not None:
+            print('applying mask')
+            ds = ds.where(clear_pixels.sel(time=ds.time))
+        elif filter_cloud:
             print('making mask')
             clear_pixels = np.logical_and(np.logical_and(ds.fmask != 0, ds.fmask != 2),
                               ds.fmask != 3)
@@ -188,7 +306,8 @@ def load_sentinel(dc, product, query, filter_cloud=True, **bands_of_interest):
 def load_clearlandsat(dc, query, sensors=('ls5', 'ls7', 'ls8'), product='nbart', dask_chunks = {'time': 1},
                       lazy_load = False, bands_of_interest=None, masked_prop=0.0, mask_dict=None,
                       mask_pixel_quality=True, mask_invalid_data=True, 
-                      ls7_slc_off=False, satellite_metadata=False):
+                      ls7_slc_off=False, satellite_metadata=False, parallel_load=False, preserve_dtype=False,
+                      cache_dir=None, cache_size_gb=10, telemetry=None):
 
     
     """Loads Landsat NBAR, NBART or FC25 and PQ data for multiple sensors (i.e. ls5, ls7, ls8) and returns a single 
@@ -258,6 +377,32 @@ def load_clearlandsat(dc, query, sensors=('ls5', 'ls7', 'ls8'), product='nbart',
     satellite_metadata : bool, optional
         An optional boolean indicating whether to return the dataset with a `satellite` variable that gives the name 
         of the satellite that made each observation in the timeseries (i.e. ls5, ls7, ls8). Defaults to False. 
+    parallel_load : bool, optional
+        An optional boolean indicating whether to load and filter data for each sensor concurrently (using one
+        thread per sensor) instead of one after another. This can substantially reduce load times for long time
+        series. Defaults to False.
+    preserve_dtype : bool, optional
+        An optional boolean indicating whether to keep the native int16 data type of the output arrays. If True,
+        poor quality pixels are set to the product's nodata value (e.g. -999) instead of NaN, invalid nodata values
+        are left unchanged regardless of `mask_invalid_data`, and the pixel quality mask is returned as a separate
+        boolean `good_quality` variable (if `mask_pixel_quality=True`). Defaults to False.
+    cache_dir : str, optional
+        An optional path to a directory used to cache results on disk. If provided, the output of each call is
+        saved as a NetCDF file named after a hash of the query and loading options, and identical calls will read
+        the cached file instead of loading data again. Cached results are reloaded if the datacube index reports
+        that datasets have been added or removed for the query. Defaults to None, which disables caching.
+    cache_size_gb : float, optional
+        The maximum total size of the files in `cache_dir` in gigabytes. When this is exceeded, the least recently
+        used cached results are deleted. Defaults to 10.
+    telemetry : callable, optional
+        An optional function that is called with a dict describing each stage of the load, which can be used to
+        record load times and data volumes in a machine-readable form (e.g. `telemetry=events.append` to collect
+        events in a list, or `telemetry=logger.info` to log them). Each dict has an `event` key: 'sensor' events
+        are emitted for each sensor and include `query_time` (index search and load setup), `filter_time` (reading
+        PQ and filtering), `obs_total`, `obs_filtered`, `output_bytes` (in-memory size of the filtered output, not
+        bytes read from disk), `compute_time` and the peak memory use of the process in `peak_memory_mb` (None
+        where this is not available, e.g. on Windows); a 'combine' event gives `combine_time` and
+        `obs_total`. Defaults to None, which disables telemetry.
     
     Returns
     -------
@@ -270,7 +415,8 @@ def load_clearlandsat(dc, query, sensors=('ls5', 'ls7', 'ls8'), product='nbart',
     Memory issues: For large data extractions, it is recommended that you set both `mask_pixel_quality=False` and 
     `mask_invalid_data=False`. Otherwise, all output variables will be coerced to float32 when NaN values are 
     inserted into the array, potentially causing your data to use 2x as much memory. Be aware that the resulting
-    arrays will contain invalid -999 values which should be considered in analyses.
+    arrays will contain invalid -999 values which should be considered in analyses. Alternatively, set
+    `preserve_dtype=True` to mask data while keeping the native int16 data type.
         
     Example
     -------    
@@ -316,132 +462,54 @@ def load_clearlandsat(dc, query, sensors=('ls5', 'ls7', 'ls8'), product='nbart',
                         (only makes sense as int) and masking
                         casts to float32.""")
     
-    # Dictionary to save results from each sensor 
-    filtered_sensors = {}
+    # Search the datacube index once for the data and PQ datasets of each sensor. These are reused for
+    # cache validation and for every `dc.load` call, rather than repeating the search for each load
+    sensor_datasets = {sensor: {'data': _find_datasets(dc, f'{sensor}_{product}_albers', query),
+                                'pq': _find_datasets(dc, f'{sensor}_pq_albers', query)}
+                       for sensor in sensors}
+
+    # If a cache directory is given, return previously cached results for an identical call if no
+    # datasets have since been indexed
+    if cache_dir:
+        cache_path = _cache_path(cache_dir, query=query, sensors=sorted(sensors), product=product,
+                                 bands_of_interest=bands_of_interest, masked_prop=masked_prop,
+                                 mask_dict=mask_dict, mask_pixel_quality=mask_pixel_quality,
+                                 mask_invalid_data=mask_invalid_data, ls7_slc_off=ls7_slc_off,
+                                 satellite_metadata=satellite_metadata, preserve_dtype=preserve_dtype)
+        datasets_hash = _datasets_hash([datasets for sensor in sensors
+                                        for datasets in sensor_datasets[sensor].values()])
+        cached_ds = _read_cache(cache_path, datasets_hash, dask_chunks)
+
+        if cached_ds is not None:
+            print(f'Loading {len(cached_ds.time)} cached timesteps from {cache_path}')
+            return cached_ds if lazy_load else cached_ds.load()
+
+    # Arguments used to load and filter each sensor
+    sensor_kwargs = dict(product=product, dask_chunks=dask_chunks, lazy_load=lazy_load,
+                         bands_of_interest=bands_of_interest, masked_prop=masked_prop,
+                         mask_dict=mask_dict, mask_pixel_quality=mask_pixel_quality,
+                         ls7_slc_off=ls7_slc_off, satellite_metadata=satellite_metadata,
+                         preserve_dtype=preserve_dtype, telemetry=telemetry)
+
+    # Iterate through all sensors, returning only observations with > mask_prop clear pixels.
+    # If `parallel_load=True`, sensors are loaded concurrently with one thread per sensor
+    if parallel_load:
+
+        with ThreadPoolExecutor(max_workers=max(1, len(sensors))) as executor:
+            futures = {sensor: executor.submit(_load_clearlandsat_sensor, dc, query, sensor,
+                                               sensor_datasets[sensor], **sensor_kwargs)
+                       for sensor in sensors}
+            sensor_results = {sensor: future.result() for sensor, future in futures.items()}
 
-    # Iterate through all sensors, returning only observations with > mask_prop clear pixels
-    for sensor in sensors:     
-        
-            # Load PQ data using dask
-            print(f'Loading {sensor}')
-            
-            # If bands of interest are given, assign measurements in dc.load call. This is
-            # for compatibility with the existing dea-notebooks load_nbarx function.
-            if bands_of_interest:
-                
-                # Lazily load Landsat data using dask              
-                data = dc.load(product=f'{sensor}_{product}_albers',
-                               measurements=bands_of_interest,
-                               group_by='solar_day', 
-                               dask_chunks=dask_chunks,
-                               **query)
-
-            # If no bands of interest given, run without specifying measurements, and 
-            # therefore return all available bands
-            else:
-                
-                # Lazily load Landsat data using dask  
-                data = dc.load(product=f'{sensor}_{product}_albers',
-                               group_by='solar_day', 
-                               dask_chunks=dask_chunks,
-                               **query)             
-
-            # Load PQ data
-            pq = dc.load(product=f'{sensor}_pq_albers',
-                         group_by='solar_day',
-                         fuse_func=ga_pq_fuser,
-                         dask_chunks=dask_chunks,
-                         **query)            
-            
-            # If resulting dataset has data, continue:
-            if data.variables:
-                
-                # Remove Landsat 7 SLC-off from PQ layer if ls7_slc_off=False
-                if not ls7_slc_off and sensor == 'ls7':
+    else:
 
-                    print('    Ignoring SLC-off observations for ls7')
-                    data = data.sel(time=data.time < np.datetime64('2003-05-30')) 
-                
-                # If more than 0 timesteps
-                if len(data.time) > 0:                       
-
-                    # Return only Landsat observations that have matching PQ data 
-                    time = (data.time - pq.time).time
-                    data = data.sel(time=time)
-                    pq = pq.sel(time=time)
-
-                    # If a custom dict is provided for mask_dict, use these values to make mask from PQ
-                    if mask_dict:
-
-                        # Mask PQ using custom values by unpacking mask_dict **kwarg
-                        good_quality = masking.make_mask(pq.pixelquality, **mask_dict)
-
-                    else:
-
-                        # Identify pixels with no clouds in either ACCA for Fmask
-                        good_quality = masking.make_mask(pq.pixelquality,                         
-                                                         cloud_acca='no_cloud',
-                                                         cloud_shadow_acca='no_cloud_shadow',
-                                                         cloud_shadow_fmask='no_cloud_shadow',
-                                                         cloud_fmask='no_cloud',
-                                                         blue_saturated=False,
-                                                         green_saturated=False,
-                                                         red_saturated=False,
-                                                         nir_saturated=False,
-                                                         swir1_saturated=False,
-                                                         swir2_saturated=False,
-                                                         contiguous=True)
-                   
-                    # Compute good data for each observation as a percentage of total array pixels. Need to
-                    # sum over x and y axes individually so that the function works with lat-lon dimensions,
-                    # and because it isn't currently possible to pass a list of axes (bug with xarray?) 
-                    data_perc = good_quality.sum(axis=1).sum(axis=1) / (good_quality.shape[1] * good_quality.shape[2])
-
-                    # Add data_perc data to Landsat dataset as a new xarray variable
-                    data['data_perc'] = xr.DataArray(data_perc, [('time', data.time)])
-
-                    # Filter by data_perc to drop low quality observations and finally import data using dask
-                    filtered = data.sel(time=data.data_perc >= masked_prop)
-                    print(f'    Loading {len(filtered.time)} filtered {sensor} timesteps')
-
-                    # Optionally apply pixel quality mask to all observations that were not dropped in previous step
-                    if mask_pixel_quality:
-                        
-                        # First change dtype to float32, then mask out values using
-                        # `.where()`. By casting to float32, we prevent `.where()` 
-                        # from automatically casting to float64, using 2x the memory
-                        # We also need to manually reset attributes due to a possible
-                        # bug in recent xarray version
-                        filtered = filtered.astype(np.float32).assign_attrs(crs=filtered.crs)
-                        filtered = filtered.where(good_quality)
-
-                    # Optionally add satellite name variable
-                    if satellite_metadata:
-                        filtered['satellite'] = xr.DataArray([sensor] * len(filtered.time), [('time', filtered.time)])
-
-                    # Add result to dictionary
-                    if lazy_load==True:
-                        filtered_sensors[sensor] = filtered
-                    else:
-                        filtered_sensors[sensor] = filtered.compute()
-
-                    # Close datasets
-                    filtered = None
-                    good_quality = None
-                    data = None
-                    pq = None            
-
-                else:
-
-                    # If there is no data for sensor or if another error occurs:
-                    print(f'    Skipping {sensor}; no valid data for query')
-                    
-            else:
+        sensor_results = {sensor: _load_clearlandsat_sensor(dc, query, sensor, sensor_datasets[sensor],
+                                                            **sensor_kwargs)
+                          for sensor in sensors}
+
+    # Keep only sensors that returned data, preserving the order of `sensors`
+    filtered_sensors = {sensor: ds for sensor, ds in sensor_results.items() if ds is not None}
 
-                # If there is no data for sensor or if another error occurs:
-                print(f'    Skipping {sensor}; no valid data for query')
-                
-                
     ############################
     # Combine multiple sensors #
     ############################
@@ -449,14 +517,15 @@ def load_clearlandsat(dc, query, sensors=('ls5', 'ls7', 'ls8'), product='nbart',
     # Proceed with concatenating only if there is more than 1 sensor processed
     if len(filtered_sensors) > 1:
 
-        # Concatenate all sensors into one big xarray dataset, and then sort by time 
+        # Merge all sensors into one big xarray dataset sorted by time
         sensor_string = ", ".join(filtered_sensors.keys())
         print(f'Combining and sorting {sensor_string} data')
-        combined_ds = xr.concat(filtered_sensors.values(), dim='time')
-        combined_ds = combined_ds.sortby('time')                                                               
+        start_time = perf_counter()
+        combined_ds = _merge_by_time(filtered_sensors.values())
+        _emit(telemetry, 'combine', combine_time=perf_counter() - start_time, obs_total=len(combined_ds.time))
 
         # Optionally filter to replace no data values with nans
-        if mask_invalid_data:
+        if mask_invalid_data and not preserve_dtype:
 
             print('    Replacing invalid -999 values with NaN (data will be coerced to float32)')
 	
@@ -472,6 +541,16 @@ def load_clearlandsat(dc, query, sensors=('ls5', 'ls7', 'ls8'), product='nbart',
         # reset pixel quality attributes
         if product == 'pq':
             combined_ds.pixelquality.attrs.update(list(filtered_sensors.values())[0].pixelquality.attrs)
+
+        # Optionally save results to the cache
+        if cache_dir:
+            print(f'    Writing results to cache {cache_path}')
+            _write_cache(combined_ds, cache_path, datasets_hash, cache_size_gb)
+
+            # Writing computes lazily loaded results, so return the written results (opened lazily)
+            # rather than computing them a second time
+            if lazy_load:
+                combined_ds = _read_cache(cache_path, datasets_hash, dask_chunks)
         
         # Return combined dataset
         return combined_ds
@@ -481,10 +560,10 @@ def load_clearlandsat(dc, query, sensors=('ls5', 'ls7', 'ls8'), product='nbart',
         
         sensor_string = ", ".join(filtered_sensors.keys())
         print(f'Returning {sensor_string} data')
-        sensor_ds = list(filtered_sensors.values())[0]
+        combined_ds = list(filtered_sensors.values())[0]
         
         # Optionally filter to replace no data values with nans
-        if mask_invalid_data:
+        if mask_invalid_data and not preserve_dtype:
 
             print('    Replacing invalid -999 values with NaN (data will be coerced to float32)')
 
@@ -496,8 +575,18 @@ def load_clearlandsat(dc, query, sensors=('ls5', 'ls7', 'ls8'), product='nbart',
             combined_ds = (combined_ds.astype(np.float32)
                            .assign_attrs(crs=combined_ds.crs))
             combined_ds = masking.mask_invalid_data(combined_ds)    
+
+        # Optionally save results to the cache
+        if cache_dir:
+            print(f'    Writing results to cache {cache_path}')
+            _write_cache(combined_ds, cache_path, datasets_hash, cache_size_gb)
+
+            # Writing computes lazily loaded results, so return the written results (opened lazily)
+            # rather than computing them a second time
+            if lazy_load:
+                combined_ds = _read_cache(cache_path, datasets_hash, dask_chunks)
         
-        return sensor_ds
+        return combined_ds
     
     else:
         
@@ -508,7 +597,8 @@ def load_clearlandsat(dc, query, sensors=('ls5', 'ls7', 'ls8'), product='nbart',
 def load_clearsentinel2(dc, query, sensors=('s2a', 's2b'), product='ard',
                         bands_of_interest=('nbart_red', 'nbart_green', 'nbart_blue', 'nbart_nir_1', 'nbart_swir_2', 'nbart_swir_3'),
                         masked_prop=0.0, mask_values=(0, 2, 3), pixel_quality_band='fmask',
-                        mask_pixel_quality=True, mask_invalid_data=True, satellite_metadata=False):
+                        mask_pixel_quality=True, mask_invalid_data=True, satellite_metadata=False,
+                        parallel_load=False, preserve_dtype=False, native_resolution=False, telemetry=None):
     
     """
     Loads Sentinel 2 data for multiple sensors (i.e. s2a, s2b), and returns a single xarray dataset containing 
@@ -523,7 +613,8 @@ def load_clearsentinel2(dc, query, sensors=('s2a', 's2b'), product='ard',
     MEMORY ISSUES: For large data extractions, it is recommended that you set both `mask_pixel_quality=False` and 
     `mask_invalid_data=False`. Otherwise, all output variables will be coerced to float64 when NaN values are 
     inserted into the array, potentially causing your data to use 4x as much memory. Be aware that the resulting
-    arrays will contain invalid -999 values which should be considered in analyses.
+    arrays will contain invalid -999 values which should be considered in analyses. Alternatively, set
+    `preserve_dtype=True` to mask data while keeping the native int16 data type.
     
     Last modified: March 2019
     Author: Robbi Bishop-Taylor
@@ -577,6 +668,30 @@ def load_clearsentinel2(dc, query, sensors=('s2a', 's2b'), product='ard',
     :param satellite_metadata:
         An optional boolean indicating whether to return the dataset with a `satellite` variable that gives the name
         of the satellite that made each observation in the time series (i.e. s2a, s2b). Defaults to False.
+
+    :param parallel_load:
+        An optional boolean indicating whether to load and filter data for each sensor concurrently (using one
+        thread per sensor) instead of one after another. Defaults to False.
+
+    :param preserve_dtype:
+        An optional boolean indicating whether to keep the native int16 data type of the output arrays. If True,
+        poor quality pixels are set to the product's nodata value (e.g. -999) instead of NaN, invalid nodata values
+        are left unchanged regardless of `mask_invalid_data`, and the pixel quality mask is returned as a separate
+        boolean `good_quality` variable (if `mask_pixel_quality=True`). Defaults to False.
+
+    :param native_resolution:
+        An optional boolean indicating whether to load bands with a coarser native resolution than the query
+        `resolution` (e.g. the 20 m `nbart_swir_2` and `nbart_swir_3` bands when loading 10 m data) at their
+        native resolution, rather than resampling them to the query resolution. These bands are returned on their
+        own spatial dimensions named with a resolution suffix (e.g. `x_20m` and `y_20m`), using a quarter of the
+        memory. Use `upsample_native_bands` (or the functions in `BandIndices.py`, which do this automatically) to
+        upsample them onto the same grid as the other bands when needed. Defaults to False.
+
+    :param telemetry:
+        An optional function that is called with a dict describing each stage of the load, as for
+        `load_clearlandsat`: 'sensor' events are emitted for each sensor and include `query_time`, `filter_time`,
+        `obs_total`, `obs_filtered`, `output_bytes`, `compute_time` and `peak_memory_mb`; a 'combine' event gives
+        `combine_time` and `obs_total`. Defaults to None, which disables telemetry.
         
     :returns:
         An xarray dataset containing only Sentinel 2 observations that contain greater than `masked_prop`
@@ -607,9 +722,9 @@ def load_clearsentinel2(dc, query, sensors=('s2a', 's2b'), product='ard',
     >>> sentinel_ds = DEADataHandling.load_clearsentinel2(dc=dc, query=query, sensors=['s2a', 's2b'], 
     ...                                    bands_of_interest=['nbart_red', 'nbart_green', 'nbart_blue'], 
     ...                                    masked_prop=0.3, mask_pixel_quality=True)
-    Loading s2a pixel quality
+    Loading s2a data and pixel quality
         Loading 3 filtered s2a timesteps
-    Loading s2b pixel quality
+    Loading s2b data and pixel quality
         Loading 2 filtered s2b timesteps
     Combining and sorting s2a, s2b data
         Replacing invalid -999 values with NaN (data will be coerced to float64)
@@ -620,86 +735,29 @@ def load_clearsentinel2(dc, query, sensors=('s2a', 's2b'), product='ard',
       
     """
 
-    # Dictionary to save results from each sensor 
-    filtered_sensors = {}
-
-    # Iterate through all sensors, returning only observations with > mask_prop clear pixels
-    for sensor in sensors:
-       
-        # If bands of interest are given, assign measurements in dc.load call. This is
-        # for compatibility with the existing dea-notebooks load_nbarx function.
-        if bands_of_interest:
-
-            # Lazily load Sentinel 2 data using dask
-            data = dc.load(product=f'{sensor}_{product}_granule',
-                            measurements=bands_of_interest,
-                            group_by='solar_day',
-                            dask_chunks={'time': 1},
-                            **query)
-
-        # If no bands of interest given, run without specifying measurements, and
-        # therefore return all available bands
-        else:
-
-            # Lazily load Sentinel 2 data using dask
-            data = dc.load(product=f'{sensor}_{product}_granule',
-                            group_by='solar_day',
-                            dask_chunks={'time': 1},
-                            **query)
-
-        # Load PQ data
-        print(f'Loading {sensor} pixel quality')
-        pq = dc.load(product=f'{sensor}_{product}_granule',
-                     measurements=[pixel_quality_band],
-                     group_by='solar_day',
-                     dask_chunks={'time': 1},
-                     **query)
-              
-        # If resulting dataset has data, continue:
-        if data.variables:
-              
-            # If more than 0 timesteps
-            if len(data.time) > 0:  
-
-                # Identify pixels with valid data
-                good_quality = np.isin(pq[pixel_quality_band], test_elements=mask_values, invert=True)
-                good_quality = pq[pixel_quality_band].where(good_quality).notnull()
-
-                # Compute good data for each observation as a percentage of total array pixels
-                data_perc = good_quality.sum(axis=1).sum(axis=1) / (good_quality.shape[1] * good_quality.shape[2])
-
-                # Add data_perc data to Sentinel 2 dataset as a new xarray variable
-                data['data_perc'] = xr.DataArray(data_perc, [('time', data.time)])
-
-                # Filter by data_perc to drop low quality observations and finally import data using dask
-                filtered = data.sel(time=data.data_perc >= masked_prop)
-                print(f'    Loading {len(filtered.time)} filtered {sensor} timesteps')
+    # Arguments used to load and filter each sensor
+    sensor_kwargs = dict(product=product, bands_of_interest=bands_of_interest, masked_prop=masked_prop,
+                         mask_values=mask_values, pixel_quality_band=pixel_quality_band,
+                         mask_pixel_quality=mask_pixel_quality, satellite_metadata=satellite_metadata,
+                         preserve_dtype=preserve_dtype, native_resolution=native_resolution,
+                         telemetry=telemetry)
 
-                # Optionally apply pixel quality mask to all observations that were not dropped in previous step
-                if mask_pixel_quality:
-                    filtered = filtered.where(good_quality)
+    # Iterate through all sensors, returning only observations with > mask_prop clear pixels.
+    # If `parallel_load=True`, sensors are loaded concurrently with one thread per sensor
+    if parallel_load:
 
-                # Optionally add satellite name
-                if satellite_metadata:
-                    filtered['satellite'] = xr.DataArray([sensor] * len(filtered.time), [('time', filtered.time)])
+        with ThreadPoolExecutor(max_workers=max(1, len(sensors))) as executor:
+            futures = {sensor: executor.submit(_load_clearsentinel2_sensor, dc, query, sensor, **sensor_kwargs)
+                       for sensor in sensors}
+            sensor_results = {sensor: future.result() for sensor, future in futures.items()}
 
-                # Add result to dictionary
-                filtered_sensors[sensor] = filtered.compute()
-
-                # Close datasets
-                filtered = None
-                good_quality = None
-                data = None
-     
-            else:
+    else:
 
-                # If there is no data for sensor or if another error occurs:
-                print(f'    Skipping {sensor}; no valid data for query')
-                    
-        else:
+        sensor_results = {sensor: _load_clearsentinel2_sensor(dc, query, sensor, **sensor_kwargs)
+                          for sensor in sensors}
 
-            # If there is no data for sensor or if another error occurs:
-            print(f'    Skipping {sensor}; no valid data for query')
+    # Keep only sensors that returned data, preserving the order of `sensors`
+    filtered_sensors = {sensor: ds for sensor, ds in sensor_results.items() if ds is not None}
             
               
     ############################
@@ -709,14 +767,15 @@ def load_clearsentinel2(dc, query, sensors=('s2a', 's2b'), product='ard',
     # Proceed with concatenating only if there is more than 1 sensor processed
     if len(filtered_sensors) > 1:
 
-        # Concatenate all sensors into one big xarray dataset, and then sort by time 
+        # Merge all sensors into one big xarray dataset sorted by time
         sensor_string = ", ".join(filtered_sensors.keys())
         print(f'Combining and sorting {sensor_string} data')
-        combined_ds = xr.concat(filtered_sensors.values(), dim='time')
-        combined_ds = combined_ds.sortby('time')  
+        start_time = perf_counter()
+        combined_ds = _merge_by_time(filtered_sensors.values())
+        _emit(telemetry, 'combine', combine_time=perf_counter() - start_time, obs_total=len(combined_ds.time))
 
         # Optionally filter to replace invalid data values with nans
-        if mask_invalid_data:
+        if mask_invalid_data and not preserve_dtype:
               
             print('    Replacing invalid -999 values with NaN (data will be coerced to float64)')
             combined_ds = masking.mask_invalid_data(combined_ds)
@@ -732,7 +791,7 @@ def load_clearsentinel2(dc, query, sensors=('s2a', 's2b'), product='ard',
         sensor_ds = list(filtered_sensors.values())[0]
         
         # Optionally filter to replace no data values with nans
-        if mask_invalid_data:
+        if mask_invalid_data and not preserve_dtype:
 
             print('    Replacing invalid -999 values with NaN (data will be coerced to float64)')
             sensor_ds = masking.mask_invalid_data(sensor_ds)       
@@ -745,6 +804,46 @@ def load_clearsentinel2(dc, query, sensors=('s2a', 's2b'), product='ard',
               f'and time range {"-".join(query["time"])}')
 
 
+def make_mask_lut(variable, **flags):
+
+    """
+    Identifies pixels in a pixel quality (PQ) array that match a set of flags, giving the same result as
+    `masking.make_mask` but using a precomputed lookup table. The table gives the result for all 65536 possible
+    16-bit PQ values, and is computed only once for each set of flags. The PQ array is then classified by
+    looking up each pixel in the table in a single pass, chunk by chunk if the array is a dask array.
+
+    Last modified: October 2026
+
+    Parameters
+    ----------
+    variable : xarray DataArray
+        A PQ array with a `flags_definition` attribute (e.g. the `pixelquality` variable of a PQ25 dataset).
+    **flags :
+        Flags to match, as passed to `masking.make_mask` (e.g. `cloud_acca='no_cloud', contiguous=True`).
+
+    Returns
+    -------
+    mask : xarray DataArray
+        A boolean array that is True for pixels matching all of `flags`.
+
+    """
+
+    # Lookup tables can only be used for 8 and 16-bit PQ data; use the original function for anything else
+    if not np.issubdtype(variable.dtype, np.integer) or variable.dtype.itemsize > 2:
+        return masking.make_mask(variable, **flags)
+
+    # Get the bits and values to test for, then a cached lookup table for these
+    flags_def = masking.get_flags_def(variable)
+    mask, mask_value = masking.create_mask_value(flags_def, **flags)
+    lookup_table = _mask_lookup_table(mask, mask_value)
+
+    def _lookup(pq_values):
+        # View as unsigned so signed int16 PQ values index the table by their bit pattern
+        return lookup_table[pq_values.astype(np.uint16)]
+
+    return xr.apply_ufunc(_lookup, variable, dask='parallelized', output_dtypes=[bool])
+
+
 def dataset_to_geotiff(filename, data):
 
     """
@@ -956,6 +1055,573 @@ def zonal_timeseries(dataArray, shp_loc, results_loc, feature_name, stat='mean',
     return statistics_df
 
 
+def _load_clearlandsat_sensor(dc, query, sensor, datasets, product, dask_chunks, lazy_load, bands_of_interest,
+                              masked_prop, mask_dict, mask_pixel_quality, ls7_slc_off, satellite_metadata,
+                              preserve_dtype, telemetry=None):
+
+    """
+    Helper function for `load_clearlandsat` that loads, filters and optionally masks data for a single
+    sensor, using the data and PQ datasets previously found in the index for the sensor (a dict with
+    'data' and 'pq' keys). Returns None if there is no valid data for the sensor.
+    """
+
+    # Load PQ data using dask
+    print(f'Loading {sensor}')
+    start_time = perf_counter()
+
+    # Keep only datasets from solar days that have both data and PQ, so that observations without
+    # matching PQ are never loaded
+    shared_days = ({solar_day(dataset) for dataset in datasets['data']} &
+                   {solar_day(dataset) for dataset in datasets['pq']})
+    data_datasets = [dataset for dataset in datasets['data'] if solar_day(dataset) in shared_days]
+    pq_datasets = [dataset for dataset in datasets['pq'] if solar_day(dataset) in shared_days]
+    
+    # If bands of interest are given, assign measurements in dc.load call. This is
+    # for compatibility with the existing dea-notebooks load_nbarx function.
+    if bands_of_interest:
+        
+        # Lazily load Landsat data using dask              
+        data = dc.load(product=f'{sensor}_{product}_albers',
+                       datasets=data_datasets,
+                       measurements=bands_of_interest,
+                       group_by='solar_day', 
+                       dask_chunks=dask_chunks,
+                       **query)
+
+    # If no bands of interest given, run without specifying measurements, and 
+    # therefore return all available bands
+    else:
+        
+        # Lazily load Landsat data using dask  
+        data = dc.load(product=f'{sensor}_{product}_albers',
+                       datasets=data_datasets,
+                       group_by='solar_day', 
+                       dask_chunks=dask_chunks,
+                       **query)             
+
+    # Load PQ data
+    pq = dc.load(product=f'{sensor}_pq_albers',
+                 datasets=pq_datasets,
+                 group_by='solar_day',
+                 fuse_func=ga_pq_fuser,
+                 dask_chunks=dask_chunks,
+                 **query)            
+    query_time = perf_counter() - start_time
+    
+    # If resulting dataset has data, continue:
+    if data.variables:
+        
+        # Remove Landsat 7 SLC-off from PQ layer if ls7_slc_off=False
+        if not ls7_slc_off and sensor == 'ls7':
+
+            print('    Ignoring SLC-off observations for ls7')
+            data = data.sel(time=data.time < np.datetime64('2003-05-30')) 
+        
+        # If more than 0 timesteps
+        if len(data.time) > 0:                       
+
+            # Return only Landsat observations that have matching PQ data 
+            time = (data.time - pq.time).time
+            data = data.sel(time=time)
+            pq = pq.sel(time=time)
+
+            # If a custom dict is provided for mask_dict, use these values to make mask from PQ
+            if mask_dict:
+
+                # Mask PQ using custom values by unpacking mask_dict **kwarg
+                good_quality = make_mask_lut(pq.pixelquality, **mask_dict)
+
+            else:
+
+                # Identify pixels with no clouds in either ACCA for Fmask
+                good_quality = make_mask_lut(pq.pixelquality,                         
+                                             cloud_acca='no_cloud',
+                                             cloud_shadow_acca='no_cloud_shadow',
+                                             cloud_shadow_fmask='no_cloud_shadow',
+                                             cloud_fmask='no_cloud',
+                                             blue_saturated=False,
+                                             green_saturated=False,
+                                             red_saturated=False,
+                                             nir_saturated=False,
+                                             swir1_saturated=False,
+                                             swir2_saturated=False,
+                                             contiguous=True)
+           
+            # Compute good data for each observation as a percentage of total array pixels. Need to
+            # sum over x and y axes individually so that the function works with lat-lon dimensions,
+            # and because it isn't currently possible to pass a list of axes (bug with xarray?) 
+            data_perc = good_quality.sum(axis=1).sum(axis=1) / (good_quality.shape[1] * good_quality.shape[2])
+
+            # Add data_perc data to Landsat dataset as a new xarray variable
+            data['data_perc'] = xr.DataArray(data_perc, [('time', data.time)])
+
+            # Filter by data_perc to drop low quality observations and finally import data using dask
+            filtered = data.sel(time=data.data_perc >= masked_prop)
+            print(f'    Loading {len(filtered.time)} filtered {sensor} timesteps')
+            filter_time = perf_counter() - start_time - query_time
+
+            # Optionally apply pixel quality mask to all observations that were not dropped in previous step,
+            # either by setting poor quality pixels to nodata (keeping int16) or NaN
+            if mask_pixel_quality and preserve_dtype:
+
+                filtered = _mask_to_nodata(filtered, good_quality)
+
+            elif mask_pixel_quality:
+                
+                # First change dtype to float32, then mask out values using
+                # `.where()`. By casting to float32, we prevent `.where()` 
+                # from automatically casting to float64, using 2x the memory
+                # We also need to manually reset attributes due to a possible
+                # bug in recent xarray version
+                filtered = filtered.astype(np.float32).assign_attrs(crs=filtered.crs)
+                filtered = filtered.where(good_quality)
+
+            # Optionally add satellite name variable
+            if satellite_metadata:
+                filtered['satellite'] = xr.DataArray([sensor] * len(filtered.time), [('time', filtered.time)])
+
+            # Compute result unless lazy loading was requested
+            if lazy_load!=True:
+                filtered = filtered.compute()
+
+            _emit(telemetry, 'sensor', sensor=sensor, query_time=query_time, filter_time=filter_time,
+                  obs_total=len(data.time), obs_filtered=len(filtered.time), output_bytes=filtered.nbytes,
+                  compute_time=perf_counter() - start_time - query_time - filter_time,
+                  peak_memory_mb=_peak_memory_mb())
+
+            return filtered
+
+        else:
+
+            # If there is no data for sensor or if another error occurs:
+            print(f'    Skipping {sensor}; no valid data for query')
+            
+    else:
+
+        # If there is no data for sensor or if another error occurs:
+        print(f'    Skipping {sensor}; no valid data for query')
+
+
+def _load_clearsentinel2_sensor(dc, query, sensor, product, bands_of_interest, masked_prop, mask_values,
+                                pixel_quality_band, mask_pixel_quality, satellite_metadata, preserve_dtype,
+                                native_resolution=False, telemetry=None):
+
+    """
+    Helper function for `load_clearsentinel2` that loads, filters and optionally masks data for a single
+    sensor. Returns None if there is no valid data for the sensor.
+    """
+
+    # Optionally split off bands with a coarser native resolution than the query, to load separately
+    native_groups = {}
+    if native_resolution:
+        if 'resolution' not in query:
+            raise ValueError("Please provide `resolution` in the query to use `native_resolution=True`")
+        if not bands_of_interest:
+            bands_of_interest = list(dc.index.products.get_by_name(f'{sensor}_{product}_granule').measurements)
+        native_groups = _native_band_groups(bands_of_interest, query['resolution'])
+        native_bands = [band for bands in native_groups.values() for band in bands]
+        bands_of_interest = [band for band in bands_of_interest if band not in native_bands]
+
+    # Bands and pixel quality come from the same product, so load them together in a single read. If
+    # bands of interest are given, assign measurements in dc.load call (adding the pixel quality band).
+    # This is for compatibility with the existing dea-notebooks load_nbarx function.
+    print(f'Loading {sensor} data and pixel quality')
+    start_time = perf_counter()
+    if bands_of_interest or native_groups:
+
+        # Lazily load Sentinel 2 data using dask
+        measurements = list(bands_of_interest)
+        if pixel_quality_band not in measurements:
+            measurements.append(pixel_quality_band)
+        data = dc.load(product=f'{sensor}_{product}_granule',
+                        measurements=measurements,
+                        group_by='solar_day',
+                        dask_chunks={'time': 1},
+                        **query)
+
+    # If no bands of interest given, run without specifying measurements, and
+    # therefore return all available bands (including pixel quality)
+    else:
+
+        # Lazily load Sentinel 2 data using dask
+        data = dc.load(product=f'{sensor}_{product}_granule',
+                        group_by='solar_day',
+                        dask_chunks={'time': 1},
+                        **query)
+    query_time = perf_counter() - start_time
+
+    # If resulting dataset has data, continue:
+    if data.variables:
+
+        # Separate pixel quality from the bands, keeping it in the output only if it was requested
+        pq = data[[pixel_quality_band]]
+        if (bands_of_interest or native_groups) and pixel_quality_band not in bands_of_interest:
+            data = data.drop(pixel_quality_band)
+
+        # If more than 0 timesteps
+        if len(data.time) > 0:  
+
+            # Identify pixels with valid data and compute good data for each observation as a percentage
+            # of total array pixels, treating any pixel quality value not in `mask_values` as good data
+            good_values = np.setdiff1d(np.arange(256), mask_values)
+            good_quality, data_perc = _fmask_good_data(pq[pixel_quality_band], good_values)
+
+            # Add data_perc data to Sentinel 2 dataset as a new xarray variable
+            data['data_perc'] = xr.DataArray(data_perc, [('time', data.time)])
+
+            # Filter by data_perc to drop low quality observations and finally import data using dask
+            filtered = data.sel(time=data.data_perc >= masked_prop)
+            print(f'    Loading {len(filtered.time)} filtered {sensor} timesteps')
+            filter_time = perf_counter() - start_time - query_time
+
+            # Optionally apply pixel quality mask to all observations that were not dropped in previous step,
+            # either by setting poor quality pixels to nodata (keeping int16) or NaN
+            if mask_pixel_quality and preserve_dtype:
+                filtered = _mask_to_nodata(filtered, good_quality)
+            elif mask_pixel_quality:
+                filtered = filtered.where(good_quality)
+
+            # Load and mask bands with a coarser native resolution on their own native resolution grid
+            for resolution, bands in native_groups.items():
+                native_ds = _load_native_bands(dc, query, f'{sensor}_{product}_granule', bands, resolution,
+                                               filtered.time, good_quality if mask_pixel_quality else None,
+                                               preserve_dtype)
+                filtered = filtered.merge(native_ds)
+
+            # Optionally add satellite name
+            if satellite_metadata:
+                filtered['satellite'] = xr.DataArray([sensor] * len(filtered.time), [('time', filtered.time)])
+
+            # Return computed result
+            filtered = filtered.compute()
+            _emit(telemetry, 'sensor', sensor=sensor, query_time=query_time, filter_time=filter_time,
+                  obs_total=len(data.time), obs_filtered=len(filtered.time), output_bytes=filtered.nbytes,
+                  compute_time=perf_counter() - start_time - query_time - filter_time,
+                  peak_memory_mb=_peak_memory_mb())
+
+            return filtered
+
+        else:
+
+            # If there is no data for sensor or if another error occurs:
+            print(f'    Skipping {sensor}; no valid data for query')
+
+    else:
+
+        # If there is no data for sensor or if another error occurs:
+        print(f'    Skipping {sensor}; no valid data for query')
+
+
+def _native_band_groups(bands, resolution):
+
+    """
+    Helper function for `load_clearsentinel2` that groups Sentinel 2 bands with a native resolution coarser than
+    the query `resolution` by their native resolution in metres (e.g. `{20: ['nbart_swir_2', 'nbart_swir_3']}`).
+    """
+
+    native_resolutions = {'coastal_aerosol': 60, 'red_edge_1': 20, 'red_edge_2': 20, 'red_edge_3': 20,
+                          'nir_2': 20, 'swir_2': 20, 'swir_3': 20}
+
+    groups = {}
+    for band in bands:
+        native = native_resolutions.get(band.split('_', 1)[-1])
+        if native is not None and native > abs(resolution[-1]):
+            groups.setdefault(native, []).append(band)
+
+    return groups
+
+
+def _load_native_bands(dc, query, product, bands, resolution, times, good_quality, preserve_dtype):
+
+    """
+    Helper function for `load_clearsentinel2` that loads `bands` for `times` on a pixel grid with the bands'
+    native `resolution`, renaming spatial dimensions with a resolution suffix (e.g. `x_20m`) so they can be
+    stored alongside bands on the query grid. If `good_quality` is given, pixels are masked using the nearest
+    pixel of the pixel quality mask.
+    """
+
+    y_res, x_res = query['resolution']
+    native_query = dict(query, resolution=(np.sign(y_res) * resolution, np.sign(x_res) * resolution))
+    data = dc.load(product=product,
+                   measurements=bands,
+                   group_by='solar_day',
+                   dask_chunks={'time': 1},
+                   **native_query)
+    data = data.sel(time=times)
+    spatial_dims = [dim for dim in data[bands[0]].dims if dim != 'time']
+
+    # Sample the pixel quality mask onto the native resolution grid, and mask using nodata or NaN
+    if good_quality is not None:
+        native_quality = good_quality.reindex({dim: data[dim] for dim in spatial_dims}, method='nearest')
+        if preserve_dtype:
+            data = _mask_to_nodata(data, native_quality).drop('good_quality')
+        else:
+            data = data.where(native_quality)
+
+    return data.rename({dim: f'{dim}_{resolution}m' for dim in spatial_dims})
+
+
+def _mask_to_nodata(ds, good_quality):
+
+    """
+    Helper function to set pixels outside `good_quality` to each variable's nodata value without
+    changing its data type. Variables without a `nodata` attribute (e.g. `data_perc`) are left
+    unchanged, and the mask is added to the output as a boolean `good_quality` variable.
+    """
+
+    masked_ds = ds.copy()
+    good_quality = good_quality.sel(time=ds.time)
+
+    for var_name, var in ds.data_vars.items():
+        if 'nodata' in var.attrs:
+            nodata = np.array(var.attrs['nodata'], dtype=var.dtype)
+            masked_ds[var_name] = var.where(good_quality, nodata).assign_attrs(var.attrs)
+
+    masked_ds['good_quality'] = good_quality
+    return masked_ds
+
+
+def _emit(telemetry, event, **fields):
+
+    """
+    Helper function that passes a telemetry event to the `telemetry` function, if one was provided.
+    """
+
+    if telemetry is not None:
+        telemetry(dict(event=event, **fields))
+
+
+def _peak_memory_mb():
+
+    """
+    Helper function that returns the peak memory use of the process in megabytes, or None where this is not
+    available (e.g. on Windows).
+    """
+
+    if resource is None:
+        return None
+
+    # `ru_maxrss` is given in bytes on macOS, and in kilobytes on other platforms
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_memory / 1024 ** 2 if sys.platform == 'darwin' else peak_memory / 1024
+
+
+def _cache_path(cache_dir, **params):
+
+    """
+    Helper function that returns the path of the cache file for a call, named using a hash of the
+    call's parameters.
+    """
+
+    params_str = json.dumps(params, sort_keys=True, default=str)
+    cache_key = hashlib.sha256(params_str.encode()).hexdigest()
+    return os.path.join(cache_dir, f'{cache_key}.nc')
+
+
+def _datasets_hash(dataset_lists):
+
+    """
+    Helper function that returns a hash of the IDs of all datasets in a list of dataset lists found in
+    the index, used to invalidate cached results when datasets are added or removed.
+    """
+
+    dataset_ids = sorted(str(dataset.id) for datasets in dataset_lists for dataset in datasets)
+    return hashlib.sha256(','.join(dataset_ids).encode()).hexdigest()
+
+
+def _read_cache(cache_path, datasets_hash, dask_chunks):
+
+    """
+    Helper function that lazily opens a cached result, or returns None if there is no cached result or
+    it is out of date.
+    """
+
+    if not os.path.exists(cache_path):
+        return None
+
+    ds = xr.open_dataset(cache_path, chunks=dask_chunks)
+    if ds.attrs.pop('cache_datasets_hash', None) != datasets_hash:
+        ds.close()
+        return None
+
+    # Mark as recently used, and restore CRS attributes
+    os.utime(cache_path)
+    for attrs in [ds.attrs] + [var.attrs for var in ds.variables.values()]:
+        if 'crs' in attrs:
+            attrs['crs'] = geometry.CRS(attrs['crs'])
+
+    return ds
+
+
+def _write_cache(ds, cache_path, datasets_hash, cache_size_gb):
+
+    """
+    Helper function that writes a result to the cache, then deletes the least recently used cached
+    results until the cache is smaller than `cache_size_gb`.
+    """
+
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # NetCDF attributes must be strings or numbers (e.g. not CRS objects)
+    def _netcdf_attrs(attrs):
+        return {key: value if isinstance(value, (str, int, float, np.number)) else str(value)
+                for key, value in attrs.items()}
+
+    ds_out = ds.copy()
+    ds_out.attrs = _netcdf_attrs(ds.attrs)
+    ds_out.attrs['cache_datasets_hash'] = datasets_hash
+    for var in ds_out.variables.values():
+        var.attrs = _netcdf_attrs(var.attrs)
+
+    # Write to a temporary file first so that a partially written file is never read from the cache
+    temp_path = f'{cache_path}.tmp'
+    ds_out.to_netcdf(temp_path)
+    os.replace(temp_path, cache_path)
+
+    # Delete least recently used results until the cache is small enough
+    cache_files = sorted((os.path.join(cache_dir, file_name) for file_name in os.listdir(cache_dir)
+                          if file_name.endswith('.nc')), key=os.path.getmtime)
+    cache_bytes = sum(os.path.getsize(file) for file in cache_files)
+
+    for file in cache_files:
+        if (cache_bytes <= cache_size_gb * 1e9) or (file == cache_path):
+            break
+        cache_bytes -= os.path.getsize(file)
+        os.remove(file)
+
+
+def _fmask_good_data(fmask, good_values):
+
+    """
+    Helper function that identifies good quality pixels in an 8-bit pixel quality array (e.g. fmask) using a
+    lookup table of `good_values`, chunk by chunk if the array is a dask array. Returns a boolean good quality
+    mask and the proportion of good quality pixels for each timestep, without any floating point copies of
+    the pixel quality array.
+    """
+
+    # Lookup table giving whether each possible 8-bit pixel quality value is good quality
+    lookup_table = np.zeros(256, dtype=bool)
+    lookup_table[np.asarray(good_values, dtype=np.uint8)] = True
+
+    def _lookup(pq_values):
+        return lookup_table[pq_values.astype(np.uint8)]
+
+    good_quality = xr.apply_ufunc(_lookup, fmask, dask='parallelized', output_dtypes=[bool])
+
+    # Count good pixels per timestep from the same mask, summing over x and y axes individually
+    # so that this also works with lat-lon dimensions
+    data_perc = good_quality.sum(axis=1).sum(axis=1) / (good_quality.shape[1] * good_quality.shape[2])
+
+    return good_quality, data_perc
+
+
+@lru_cache(maxsize=32)
+def _mask_lookup_table(mask, mask_value):
+
+    """
+    Helper function for `make_mask_lut` that returns a boolean lookup table giving whether each
+    possible 16-bit PQ value matches `mask_value` for the bits in `mask`.
+    """
+
+    return (np.arange(2 ** 16, dtype=np.uint16) & mask) == mask_value
+
+
+def _find_datasets(dc, product, query, solar_days=None):
+
+    """
+    Helper function to search the datacube index for the datasets of `product` matching `query`,
+    optionally restricted to datasets whose solar day is one of `solar_days`. Only spatial, time and
+    index search keywords are used for the search, so the same query dict used for loading can be passed
+    in (other `dc.load` keywords such as `output_crs` or `skip_broken_datasets` are ignored). The result
+    can be passed to `dc.load` using the `datasets` keyword.
+    """
+
+    search_keys = (set(SPATIAL_KEYS + CRS_KEYS) | {'geopolygon', 'like', 'time', 'source_filter'} |
+                   dc.index.datasets.get_field_names(product))
+    search_terms = {key: value for key, value in query.items()
+                    if key in search_keys and key != 'product'}
+    datasets = dc.find_datasets(product=product, **search_terms)
+
+    if solar_days is not None:
+        datasets = [dataset for dataset in datasets if solar_day(dataset) in solar_days]
+
+    return datasets
+
+
+def _solar_days(dc, datasets, times):
+
+    """
+    Helper function that returns the set of solar days of the timesteps `times` of data loaded
+    from `datasets` using `group_by='solar_day'`. Datasets are grouped the same way `dc.load`
+    groups them, so timesteps are matched to their local solar day rather than their UTC date.
+    """
+
+    grouped = dc.group_datasets(datasets, query_group_by(group_by='solar_day'))
+    return {solar_day(dataset) for group in grouped.sel(time=times).values for dataset in group}
+
+
+def _merge_by_time(datasets):
+
+    """
+    Helper function that combines datasets that are each already sorted by time into a single dataset
+    sorted by time. Instead of concatenating and then sorting (which copies the data twice), the output
+    arrays are allocated once and each input's timesteps are written directly into their sorted positions.
+    Lazily loaded (dask) inputs, and inputs whose non-time coordinates (e.g. `x` and `y`) differ, are
+    concatenated and sorted as normal, so that they are aligned by `xr.concat` rather than copied by position.
+    """
+
+    datasets = list(datasets)
+    template = datasets[0]
+    var_names = set(template.variables)
+    grid_coords = {name: coord for name, coord in template.coords.items() if 'time' not in coord.dims}
+
+    if (any(var.chunks for ds in datasets for var in ds.variables.values()) or
+            any(set(ds.variables) != var_names for ds in datasets) or
+            any(not coord.equals(ds[name]) for ds in datasets for name, coord in grid_coords.items())):
+        return xr.concat(datasets, dim='time').sortby('time')
+
+    # Identify the sorted output position of each input timestep. A stable sort of the concatenated
+    # (already sorted) times merges the sorted runs from each input
+    times = np.concatenate([ds.time.values for ds in datasets])
+    order = np.argsort(times, kind='mergesort')
+    positions = np.empty_like(order)
+    positions[order] = np.arange(len(order))
+
+    # Allocate each output array with time along its first axis, then write each input into it
+    merged, merged_dims = {}, {}
+    for name, var in template.variables.items():
+        if 'time' not in var.dims or name == 'time':
+            continue
+        merged_dims[name] = ('time',) + tuple(dim for dim in var.dims if dim != 'time')
+        dtype = np.result_type(*[ds[name].dtype for ds in datasets])
+        shape = (len(times),) + tuple(template.sizes[dim] for dim in merged_dims[name][1:])
+        merged[name] = np.empty(shape, dtype=dtype)
+
+    start = 0
+    for ds in datasets:
+        ds_positions = positions[start:start + len(ds.time)]
+        for name, values in merged.items():
+            values[ds_positions] = ds[name].transpose(*merged_dims[name]).values
+        start += len(ds.time)
+
+    # Build output dataset with the same coordinates, variables and attributes as the inputs
+    coords = dict(grid_coords)
+    coords['time'] = ('time', times[order], template.time.attrs)
+    data_vars = {}
+    for name, var in template.variables.items():
+        if name in merged:
+            variable = (merged_dims[name], merged[name], var.attrs)
+            if name in template.coords:
+                coords[name] = variable
+            else:
+                data_vars[name] = variable
+        elif name in template.data_vars:
+            data_vars[name] = var
+
+    return xr.Dataset(data_vars, coords=coords, attrs=template.attrs)
+
+
 # The following tests are run if the module is called directly (not when being imported).
 # To do this, run the following: `python {modulename}.py`
 
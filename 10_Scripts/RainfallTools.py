@@ -3,24 +3,73 @@
 '''RainfallTools contains a set of python functions for working with rainfall data.
 Available functions:
     load_rainfall
-    
-Last modified: October 2018
-Authors: Bex Dunn, Vanessa Newey 
-    
+
+Last modified: October 2026
+Authors: Bex Dunn, Vanessa Newey
+
 '''
 import datacube
 import numpy as np
 import xarray as xr
+from functools import lru_cache
 
-def load_rainfall(query):
+def load_rainfall(query, aggregate=None, aggregate_func='sum', dask_chunks=None, lazy_load=False,
+                  config='/g/data/r78/bom_grids/rainfall.conf'):
     ''' Loads the rainfall grids from 1901 to the most recent from the staging database,
-    pending the official publication of gridded rainfall data by BoM. 
-    Last modified: Oct 2018
-    Author: Vanessa Newey'''
-    
-    dc_rf =datacube.Datacube(config='/g/data/r78/bom_grids/rainfall.conf')
-    
-    rf_data = dc_rf.load(product = 'rainfall_grids_1901_2017',align=(0.025,0.027), **query)
+    pending the official publication of gridded rainfall data by BoM.
+
+    The connection to the rainfall database is created once and reused by later calls.
+    If `aggregate` is given, rainfall is summed (or otherwise combined using `aggregate_func`)
+    over each period (e.g. 'MS' for monthly or 'AS' for annual totals) chunk by chunk while
+    the data is loaded, so the full daily time series is never held in memory.
+
+    Last modified: Oct 2026
+    Author: Vanessa Newey
+
+    :param query:
+        A dict containing the query bounds. Can include lat/lon, time etc.
+    :param aggregate:
+        An optional pandas time frequency (e.g. 'MS', 'QS' or 'AS') to aggregate rainfall to.
+        Defaults to None, which returns the original grids.
+    :param aggregate_func:
+        The name of the xarray reduction used to aggregate rainfall in each period (e.g. 'sum',
+        'mean' or 'max'). Defaults to 'sum'.
+    :param dask_chunks:
+        An optional dict of dask chunk sizes to load data with (e.g. `{'time': 365}`). Defaults
+        to None, which loads data eagerly unless `aggregate` or `lazy_load` is given, in which
+        case a year of data is loaded per chunk.
+    :param lazy_load:
+        Whether to return a lazy (dask) array instead of computing the result. Defaults to False.
+    :param config:
+        Path to the datacube config file for the rainfall database.
+    :returns:
+        An xarray dataset of rainfall grids, aggregated to `aggregate` if given.
+    '''
+
+    dc_rf = _rainfall_datacube(config)
+
+    # Load lazily if the result is to be aggregated or returned lazily
+    if dask_chunks is None and (aggregate or lazy_load):
+        dask_chunks = {'time': 365}
+
+    rf_data = dc_rf.load(product = 'rainfall_grids_1901_2017',align=(0.025,0.027),
+                         dask_chunks=dask_chunks, **query)
     print('These rainfall grids have been realigned by the load_rainfall function - if you think this ',
-          ' may be incorrect then check your data and metadata then contact BDunn or VNewey'
-    return rf_data
\ No newline at end of file
+          ' may be incorrect then check your data and metadata then contact BDunn or VNewey')
+
+    # Aggregate each period as part of the dask graph, so periods are computed chunk by chunk
+    if aggregate:
+        rf_data = getattr(rf_data.resample(time=aggregate), aggregate_func)(dim='time')
+
+    if dask_chunks is not None and not lazy_load:
+        rf_data = rf_data.compute()
+
+    return rf_data
+
+
+@lru_cache(maxsize=None)
+def _rainfall_datacube(config):
+    '''Helper function for `load_rainfall` that returns a Datacube connected using `config`,
+    creating it only once for each config.'''
+
+    return datacube.Datacube(config=config)
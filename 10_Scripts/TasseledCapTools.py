@@ -17,7 +17,7 @@ from datacube_stats.statistics import TCWStats
 
 TasseledCapTools is intended for applications where TCWStats doesn't return intermediate
 results, or where TCWStats handles memory differently to TasseledCapTools.
-Last modified: June 2018
+Last modified: October 2026
 Authors: Bex Dunn, Robbi Bishop-Taylor
 
 Available functions:
@@ -28,6 +28,7 @@ Available functions:
 import dask
 import os
 import sys
+import numpy as np
 import xarray as xr
 
 
@@ -104,12 +105,18 @@ def thresholded_tasseled_cap(sensor_data, tc_bands=['greenness', 'brightness', '
 
 def pct_exceedance_tasseled_cap(sensor_data, tc_bands=['greenness', 'brightness', 'wetness'],
                              greenness_threshold=700,brightness_threshold=4000,
-                             wetness_threshold=-600, drop=True, drop_tc_bands=True):
+                             wetness_threshold=-600, drop=True, drop_tc_bands=True, time_chunk=50):
     '''counts the number of thresholded tasseled cap scenes per pixel and divides by the 
     number of tasseled cap scenes per pixel. Returns the percentage of scenes exceeding the
     tasselled cap thresholds for the requested tasseled cap bands as an xarray.
 
-    Last modified: June 2018
+    The time series is processed `time_chunk` timesteps at a time: tasseled cap bands are
+    computed for each chunk of timesteps, and per-pixel counts of valid and exceeding scenes 
+    are accumulated for all requested bands at once. Only these counts are kept between 
+    chunks, so memory use depends on the size of a chunk rather than the length of the 
+    time series (if `sensor_data` is a dask dataset, each chunk is loaded once, when needed).
+
+    Last modified: October 2026
     Authors: Bex Dunn, Robbi Bishop-Taylor
 
     :attr sensor_data: input xarray dataset with six Landsat bands
@@ -119,34 +126,44 @@ def pct_exceedance_tasseled_cap(sensor_data, tc_bands=['greenness', 'brightness'
     :attr brightness_threshold: optional threshold as float
     :attr wetness_threshold: optional threshold as float
     :attr drop: if 'drop = False', return all original Landsat bands
-    :attr drop_tc_bands: if 'drop_tc_bands = False', return all unthresholded tasseled 
-    cap bands as well as the thresholded bands
-    :attr tc_kwargs: a dictionary of this function's input arguments needed by
-    the nested tasseled_cap function
-    :attr thresholded tc_kwargs:a dictionary of this function's input arguments needed by
-    the nested thresholded_tasseled_cap function
+    :attr drop_tc_bands: kept for compatibility with thresholded_tasseled_cap; tasseled cap
+    bands are never returned
+    :attr time_chunk: number of timesteps to compute tasseled cap bands for at a time
     :returns: xarray dataset with the percentage exceedance of each threshold. 
     ##FIXME - may want to change this so that you don't get the same thing for all time.
     """
     '''
-    tc_kwargs={'sensor_data':sensor_data, 
-               'tc_bands':tc_bands,
-               'drop':drop}
-    
-    thresholded_tc_kwargs={**tc_kwargs, 
+
+    analysis_thresholds = {'wetness_threshold': wetness_threshold,
                            'greenness_threshold': greenness_threshold,
-                           'brightness_threshold': brightness_threshold,
-                           'wetness_threshold':wetness_threshold,
-                           'drop_tc_bands':drop_tc_bands}
-                               
-    pct_exceedance_array = sensor_data.copy(deep=True)
-    tc_bands=['greenness', 'brightness', 'wetness']
-    for tc_band in tc_bands:
-        pct_exceedance_array[str(tc_band+'_pct_exceedance')] = thresholded_tasseled_cap(**thresholded_tc_kwargs)[str(tc_band+'_thresholded')].count(dim='time')/        tasseled_cap(**tc_kwargs)[tc_band].count(dim='time')
+                           'brightness_threshold': brightness_threshold}
+
+    # Per-pixel counts of valid and exceeding scenes for each tasseled cap band
+    tc_data = sensor_data[['blue', 'green', 'red', 'nir', 'swir1', 'swir2']]
+    pixels = tc_data.blue.isel(time=0, drop=True)
+    valid_counts = {tc_band: np.zeros(pixels.shape, dtype='int32') for tc_band in tc_bands}
+    exceedance_counts = {tc_band: np.zeros(pixels.shape, dtype='int32') for tc_band in tc_bands}
+
+    # Compute tasseled cap bands for each chunk of timesteps (loading the chunk only once)
+    # and add to the counts
+    for i in range(0, tc_data.sizes['time'], time_chunk):
+        tc_chunk = tasseled_cap(tc_data.isel(time=slice(i, i + time_chunk)), tc_bands=tc_bands).compute()
+        for tc_band in tc_bands:
+            tc_array = tc_chunk[tc_band].transpose('time', *pixels.dims).values
+            valid_counts[tc_band] += (~np.isnan(tc_array)).sum(axis=0, dtype='int32')
+            exceedance_counts[tc_band] += (tc_array > analysis_thresholds[str(tc_band+'_threshold')]).sum(axis=0, dtype='int32')
+
     # If drop = True, remove original bands
     if drop:
-        bands_to_drop = list(sensor_data.data_vars)
-        pct_exceedance_array = pct_exceedance_array.drop(bands_to_drop)
+        pct_exceedance_array = sensor_data.drop(list(sensor_data.data_vars))
+    else:
+        pct_exceedance_array = sensor_data.copy()
+
+    for tc_band in tc_bands:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pct_exceedance = exceedance_counts[tc_band] / valid_counts[tc_band]
+        pct_exceedance_array[str(tc_band+'_pct_exceedance')] = xr.DataArray(pct_exceedance, coords=pixels.coords,
+                                                                              dims=pixels.dims)
 
     return pct_exceedance_array
    
@@ -162,9 +162,17 @@ Authors: Erin Telfer, Bex Dunn
 
     no_data =-9999
 
+    # Identify pixels set to nodata in any band (e.g. int16 data masked using
+    # load_clearlandsat(..., preserve_dtype=True)) so they can be excluded from the output
+    invalid = np.zeros(shape, dtype=bool)
+    for band in (blue, green, red, nir, swir1, swir2):
+        if 'nodata' in band.attrs:
+            invalid |= band.values == band.attrs['nodata']
+
     classified = _run_regression(blue.values, green.values, red.values, nir.values, swir1.values, swir2.values)
 
     classified_clean=classified.astype('float64')
+    classified_clean[invalid] = np.nan
     
     y = dataset_in.y
     x = dataset_in.x
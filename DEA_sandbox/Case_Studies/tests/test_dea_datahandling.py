@@ -0,0 +1,72 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('datacube')
+from datacube.api.query import Query
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from utils import dea_datahandling
+
+
+class _StubIndex:
+    """
+    Minimal stand-in for a datacube index, providing the search fields 
+    of the Sentinel 2 NRT products.
+    """
+
+    def __init__(self):
+        self.datasets = self
+
+    def get_field_names(self, product_name=None):
+        return {'time', 'lat', 'lon', 'platform', 'instrument', 
+                'region_code', 'cloud_cover'}
+
+
+class _StubDatacube:
+    """
+    Minimal stand-in for `datacube.Datacube` that validates searches 
+    using datacube's `Query` (which raises `LookupError` for unknown 
+    keywords) and records them, without finding any datasets.
+    """
+
+    def __init__(self):
+        self.index = _StubIndex()
+        self.searches = []
+
+    def find_datasets(self, **search_terms):
+        Query(self.index, **search_terms)
+        self.searches.append(search_terms)
+        return []
+
+
+def test_load_ard_incremental_searches_without_load_ard_params(
+        tmp_path, monkeypatch):
+
+    # Record the state file attributes instead of writing NetCDF
+    written = []
+    monkeypatch.setattr(dea_datahandling, '_write_netcdf',
+                        lambda ds, path, **attrs: written.append(attrs))
+
+    dc = _StubDatacube()
+    ds = dea_datahandling.load_ard_incremental(
+        dc=dc,
+        state_path=str(tmp_path / 'state.nc'),
+        products=['s2a_nrt_granule', 's2b_nrt_granule'],
+        min_gooddata=0.5,
+        measurements=['nbar_red', 'nbar_nir_1'],
+        x=(152.429994, 152.395805),
+        y=(-24.974997, -24.995971),
+        time=('2019-01-01', '2019-03-31'),
+        output_crs='EPSG:3577',
+        resolution=(-10, 10))
+
+    assert ds is None
+    assert [search['product'] for search in dc.searches] == [
+        's2a_nrt_granule', 's2b_nrt_granule']
+    for search in dc.searches:
+        assert 'min_gooddata' not in search
+        assert 'output_crs' not in search
+        assert search['time'] == ('2019-01-01T00:00:00', '2019-03-31')
+    assert len(written) == 1
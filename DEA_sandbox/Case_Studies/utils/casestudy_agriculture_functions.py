@@ -31,17 +31,25 @@ import ipywidgets as widgets
 
 # Load utility functions
 from utils.DEADataHandling import load_clearsentinel2
+from utils.dea_datahandling import load_ard_incremental
 from utils.utils import transform_from_wgs_poly
 from utils.BandIndices import calculate_indices
 
 
-def load_agriculture_data():
+def load_agriculture_data(state_path=None):
     """
     Loads Sentinel-2 Near Real Time (NRT) product for the agriculture
     case-study area. The NRT product is provided for the last 90 days.
-    Last modified: May 2019
+    Last modified: October 2026
     Author: Caitlin Adams (FrontierSI)
 
+    inputs
+    state_path - optional path to a NetCDF file used to keep the data
+    between runs. If given, only scenes acquired since the last run are
+    loaded and added to the previous data, and scenes older than 90 days
+    are dropped (see `load_ard_incremental`). Defaults to None, which
+    loads all 90 days every time.
+
     outputs
     ds - data set containing combined, masked data from Sentinel-2a and -2b.
     Masked values are set to 'nan'
@@ -89,15 +97,26 @@ def load_agriculture_data():
     # Setting this to 0.0 includes all images
     min_good_pixel_prop = 0.5
 
-    # Load the data and mask out bad quality pixels
-    ds_s2 = load_clearsentinel2(
-        dc=dc,
-        query=query,
-        sensors=['s2a', 's2b'],
-        product='nrt',
-        bands_of_interest=measurements,
-        masked_prop=min_good_pixel_prop
-    )
+    # Load the data and mask out bad quality pixels, optionally loading
+    # only new scenes since the last run
+    if state_path:
+        ds_s2 = load_ard_incremental(
+            dc=dc,
+            state_path=state_path,
+            products=['s2a_nrt_granule', 's2b_nrt_granule'],
+            min_gooddata=min_good_pixel_prop,
+            measurements=list(measurements),
+            **query
+        )
+    else:
+        ds_s2 = load_clearsentinel2(
+            dc=dc,
+            query=query,
+            sensors=['s2a', 's2b'],
+            product='nrt',
+            bands_of_interest=measurements,
+            masked_prop=min_good_pixel_prop
+        )
 
     # Calculate the normalised difference vegetation index (NDVI) across
     # all pixels for each image.
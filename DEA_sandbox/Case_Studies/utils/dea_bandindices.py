@@ -12,18 +12,80 @@ Last modified: September 2019
 
 '''
 
+# Import required packages
+import ast
+import numpy as np
+import xarray as xr
+from collections import Counter
+from functools import lru_cache
+
+# numexpr is used to evaluate index formulas as fused kernels if it is
+# installed; otherwise formulas are evaluated using numpy
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+
+# Bands used by the tasseled cap transformation, and coefficients for 
+# each tasseled cap band (Crist 1985)
+_TC_BANDS = ['blue', 'green', 'red', 'nir', 'swir1', 'swir2']
+_TC_COEFFICIENTS = {
+    'TCW': [0.0315, 0.2021, 0.3102, 0.1594, -0.6806, -0.6109],
+    'TCG': [-0.1603, -0.2819, -0.4934, 0.7940, -0.0002, -0.1446],
+    'TCB': [0.2043, 0.4158, 0.5524, 0.5741, 0.3124, -0.2303]
+}
+
+# Scale factor and nodata value used for scaled int16 index outputs
+_INT16_SCALE = 10000
+_INT16_NODATA = -32768
+
+# Functions that can be used in index formulas
+_EXPRESSION_FUNCTIONS = {
+    'sqrt': np.sqrt,
+    'exp': np.exp,
+    'log': np.log,
+    'abs': np.abs,
+    'where': np.where
+}
+
+# Operators that can be used in index formulas
+_EXPRESSION_OPERATORS = {
+    ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', 
+    ast.Pow: '**', ast.Mod: '%', ast.BitAnd: '&', ast.BitOr: '|',
+    ast.USub: '-', ast.UAdd: '+', ast.Invert: '~',
+    ast.Gt: '>', ast.GtE: '>=', ast.Lt: '<', ast.LtE: '<=', 
+    ast.Eq: '==', ast.NotEq: '!='
+}
+
+# Registered remote sensing indices, as a dictionary mapping each index
+# name to the bands its formula uses, its formula, and the other indices
+# its formula uses. Indices are added using `register_index`
+_INDEX_EXPRESSIONS = {}
+
 
 # Define custom functions
 def calculate_indices(ds,
                       index=None,
                       collection=None,
-                      custom_varname=None):
+                      custom_varname=None,
+                      dtype='float32'):
     """
-    Takes an xarray dataset containing spectral bands, calculates one of
-    a set of remote sensing indices, and adds the resulting array as a 
-    new variable in the original dataset.  
+    Takes an xarray dataset containing spectral bands, calculates one or
+    more of a set of remote sensing indices, and adds the resulting 
+    arrays as new variables in the original dataset.  
+    
+    Multiple indices are calculated together in a single pass over the 
+    input bands (chunk by chunk for dask arrays), which is much faster 
+    than calling the function once for each index. Terms that are 
+    shared between the requested index formulas (e.g. `nir - red`), and 
+    indices used by other indices (e.g. EVI for LAI), are only 
+    calculated once. If `numexpr` is installed, each formula is 
+    evaluated as a single fused kernel, without creating a full-size 
+    temporary array for each operation in the formula. New indices can 
+    be added using `register_index`.
     
-    Last modified: September 2019
+    Last modified: October 2026
     
     Parameters
     ----------  
@@ -31,8 +93,9 @@ def calculate_indices(ds,
         A two-dimensional or multi-dimensional array with containing the 
         spectral bands required to calculate the index. These bands are 
         used as inputs to calculate the selected water index.
-    index : str
-        A string giving the name of the index to calculate:
+    index : str or list of str
+        A string giving the name of the index to calculate, or a list 
+        of index names to calculate together:
         'NDVI' (Normalised Difference Vegetation Index, Rouse 1973)
         'EVI' (Enhanced Vegetation Index, Huete 2002),
         'LAI' (Leaf Area Index, Boegh 2002),
@@ -54,7 +117,8 @@ def calculate_indices(ds,
         'TCB' (Tasseled Cap Brightness, Crist 1985),
         'CMR' (Clay Minerals Ratio, Drury 1987),
         'FMR' (Ferrous Minerals Ratio, Segal 1982),
-        'IOR' (Iron Oxide Ratio, Segal 1982)   
+        'IOR' (Iron Oxide Ratio, Segal 1982),
+        or any index added using `register_index`.
     collection : str
         An string that tells the function what data collection is 
         being used to calculate the index. This is necessary because 
@@ -63,124 +127,50 @@ def calculate_indices(ds,
         Landsat Collection 2), 'ga_landsat_3' (for GA Landsat 
         Collection 3) and 'ga_sentinel2_1' (for GA Sentinel 2 
         Collection 1).
-    custom_varname : str, optional
+    custom_varname : str or list of str, optional
         By default, the original dataset will be returned with 
         a new index variable named after `index` (e.g. 'NDVI'). To 
         specify a custom name instead, you can supply e.g. 
-        `custom_varname='custom_name'`. 
+        `custom_varname='custom_name'`, or a list of names with one 
+        name for each index if `index` is a list. 
+    dtype : str, optional
+        The data type of the output indices. The default 'float32' 
+        calculates and returns indices as 32-bit floats, using half the 
+        memory of 'float64' with no meaningful loss of precision. 
+        'float64' calculates and returns 64-bit floats. 'int16' 
+        calculates indices as 32-bit floats, then stores them as 16-bit 
+        integers multiplied by 10000 (e.g. an NDVI of 0.5123 is stored 
+        as 5123), with NaN stored as -32768. The `scale_factor` and 
+        `nodata` attributes of the output give these values. This is 
+        suitable for storing indices that range from -1.0 to 1.0 (e.g. 
+        NDVI); values outside -3.2767 to 3.2767 are clipped.
         
     Returns
     -------
     ds : xarray Dataset
         The original xarray Dataset inputted into the function, with a 
-        new varible containing the remote sensing index as a DataArray.
+        new varible containing each remote sensing index as a DataArray.
     """
 
-    # Dictionary containing remote sensing index band recipes
-    index_dict = {
-                  # Normalised Difference Vegation Index, Rouse 1973
-                  'NDVI': lambda ds: (ds.nir - ds.red) /
-                                     (ds.nir + ds.red),
-
-                  # Enhanced Vegetation Index, Huete 2002
-                  'EVI': lambda ds: ((2.5 * (ds.nir - ds.red)) /
-                                     (ds.nir + 6 * ds.red -
-                                      7.5 * ds.blue + 1)),
-
-                  # Leaf Area Index, Boegh 2002
-                  'LAI': lambda ds: (3.618 * ((2.5 * (ds.nir - ds.red)) /
-                                     (ds.nir + 6 * ds.red -
-                                      7.5 * ds.blue + 1)) - 0.118),
-
-                  # Soil Adjusted Vegetation Index, Huete 1988
-                  'SAVI': lambda ds: ((1.5 * (ds.nir - ds.red)) /
-                                      (ds.nir + ds.red + 0.5)),
-
-                  # Normalised Difference Moisture Index, Gao 1996
-                  'NDMI': lambda ds: (ds.nir - ds.swir1) /
-                                     (ds.nir + ds.swir1),
-
-                  # Normalised Burn Ratio, Lopez Garcia 1991
-                  'NBR': lambda ds: (ds.nir - ds.swir2) /
-                                    (ds.nir + ds.swir2),
-
-                  # Burn Area Index, Martin 1998
-                  'BAI': lambda ds: (1.0 / ((0.10 - ds.red) ** 2 +
-                                            (0.06 - ds.nir) ** 2)),
-
-                  # Normalised Difference Built-Up Index, Zha 2003
-                  'NDBI': lambda ds: (ds.swir1 - ds.nir) /
-                                     (ds.swir1 + ds.nir),
-
-                  # Normalised Difference Snow Index, Hall 1995
-                  'NDSI': lambda ds: (ds.green - ds.swir1) /
-                                     (ds.green + ds.swir1),
-
-                  # Normalised Difference Water Index, McFeeters 1996
-                  'NDWI': lambda ds: (ds.green - ds.nir) /
-                                     (ds.green + ds.nir),
-
-                  # Modified Normalised Difference Water Index, Xu 2006
-                  'MNDWI': lambda ds: (ds.green - ds.swir1) /
-                                      (ds.green + ds.swir1),
-
-                  # Automated Water Extraction Index (no shadows), Feyisa 2014
-                  'AWEI_ns': lambda ds: (4 * (ds.green - ds.swir1) -
-                                        (2.5 * ds.nir * + 2.75 * ds.swir2)),
-
-                  # Automated Water Extraction Index (shadows), Feyisa 2014
-                  'AWEI_sh': lambda ds: (ds.blue + 2.5 * ds.green -
-                                         1.5 * (ds.nir + ds.swir1) -
-                                         2.5 * ds.swir2),
-
-                  # Water Index, Fisher 2016
-                  'WI': lambda ds: (1.7204 + 171 * ds.green + 3 * ds.red -
-                                    70 * ds.nir - 45 * ds.swir1 -
-                                    71 * ds.swir2),
-
-                  # Tasseled Cap Wetness, Crist 1985
-                  'TCW': lambda ds: (0.0315 * ds.blue + 0.2021 * ds.green +
-                                     0.3102 * ds.red + 0.1594 * ds.nir +
-                                    -0.6806 * ds.swir1 + -0.6109 * ds.swir2),
-
-                  # Tasseled Cap Greeness, Crist 1985
-                  'TCG': lambda ds: (-0.1603 * ds.blue + -0.2819 * ds.green +
-                                     -0.4934 * ds.red + 0.7940 * ds.nir +
-                                     -0.0002 * ds.swir1 + -0.1446 * ds.swir2),
-
-                  # Tasseled Cap Brightness, Crist 1985
-                  'TCB': lambda ds: (0.2043 * ds.blue + 0.4158 * ds.green +
-                                     0.5524 * ds.red + 0.5741 * ds.nir +
-                                     0.3124 * ds.swir1 + -0.2303 * ds.swir2),
-
-                  # Clay Minerals Ratio, Drury 1987
-                  'CMR': lambda ds: (ds.swir1 / ds.swir2),
-
-                  # Ferrous Minerals Ratio, Segal 1982
-                  'FMR': lambda ds: (ds.swir1 / ds.nir),
-
-                  # Iron Oxide Ratio, Segal 1982
-                  'IOR': lambda ds: (ds.red / ds.blue)
-    }
-
-    # Select a water index function based on 'water_index'      
-    index_func = index_dict.get(index)
+    # Allow a single index or a list of indices to be calculated
+    indices = [index] if isinstance(index, str) else index
     
     # If no index is provided or if no function is returned due to an 
     # invalid option being provided, raise an exception informing user to 
     # choose from the list of valid options
-    if index is None:
+    if not indices:
         
         raise ValueError(f"No remote sensing `index` was provided. Please "
                           "refer to the function \ndocumentation for a full "
                           "list of valid options for `index` (e.g. 'NDVI')")
+    
+    for index_name in indices:
+        if index_name not in _INDEX_EXPRESSIONS:
         
-    elif index_func is None:
-        
-        raise ValueError(f"The selected index '{index}' is not one of the "
-                          "valid remote sensing index options. \nPlease "
-                          "refer to the function documentation for a full "
-                          "list of valid options for `index`")
+            raise ValueError(f"The selected index '{index_name}' is not one "
+                              "of the valid remote sensing index options. "
+                              "\nPlease refer to the function documentation "
+                              "for a full list of valid options for `index`")
 
     # Rename bands to a consistent format if depending on what collection
     # is specified in `collection`. This allows the same index calculations
@@ -251,19 +241,359 @@ def calculate_indices(ds,
                           "'ga_landsat_2', 'ga_landsat_3' or "
                           "'ga_sentinel2_1'")
         
-    # Apply index function after normalising to 0.0-1.0 by dividing by 10K
-    try:
-        index_array = index_func(ds.rename(bands_to_rename)/1000.0)
-    except AttributeError:
+    # Identify the bands required to calculate all indices, including 
+    # any other indices they use
+    ds_renamed = ds.rename(bands_to_rename)
+    required_indices = _index_dependencies(indices)
+    required_bands = []
+    for index_name in required_indices:
+        for band_name in _INDEX_EXPRESSIONS[index_name][0]:
+            if band_name not in required_bands:
+                required_bands.append(band_name)
+    
+    missing_bands = [band_name for band_name in required_bands 
+                     if band_name not in ds_renamed.data_vars]
+    if missing_bands:
         raise ValueError(f'Please verify that all bands required to '
-                         f'compute {index} are present in `ds`. \n'
-                         f'These bands may vary depending on the `collection` '
-                         f'(e.g. the Landsat `nbart_nir` band \n'
-                         f'is equivelent to `nbart_nir_1` for Sentinel 2)')
-
-    # Add as a new variable in dataset
-    output_band_name = custom_varname if custom_varname else index
-    ds[output_band_name] = index_array
+                         f'compute {", ".join(indices)} are present in `ds`. '
+                         f'\nThese bands may vary depending on the '
+                         f'`collection` (e.g. the Landsat `nbart_nir` band '
+                         f'\nis equivelent to `nbart_nir_1` for Sentinel 2)')
+
+    # Nodata values in integer bands (e.g. data loaded using 
+    # `load_ard(..., preserve_dtype=True)`) are replaced with NaN so 
+    # that they are not used to calculate the index
+    bands = [ds_renamed[band_name] for band_name in required_bands]
+    nodata_values = [band.attrs['nodata'] 
+                     if ('nodata' in band.attrs and 
+                         np.issubdtype(band.dtype, np.integer)) else None
+                     for band in bands]
+
+    # Indices are calculated in 64-bit floats only if requested
+    if dtype not in ('float32', 'float64', 'int16'):
+        raise ValueError(f"'{dtype}' is not a valid option for `dtype`. "
+                          "Please specify either 'float32', 'float64' or "
+                          "'int16'")
+    output_dtype = np.dtype(dtype)
+    calc_dtype = np.dtype('float64' if dtype == 'float64' else 'float32')
+
+    # Calculate all indices in a single pass over the input bands, chunk
+    # by chunk if the bands are dask arrays, evaluating shared terms and 
+    # indices used by other indices first. Results are returned with an 
+    # extra `index` dimension
+    steps, constants = _evaluation_steps(tuple(
+        (index_name, _INDEX_EXPRESSIONS[index_name][1]) 
+        for index_name in required_indices))
+    index_arrays = xr.apply_ufunc(
+        _calculate_index_arrays, *bands,
+        kwargs=dict(band_names=required_bands,
+                    nodata_values=nodata_values,
+                    index_names=indices,
+                    steps=steps,
+                    constants=constants,
+                    calc_dtype=calc_dtype,
+                    output_dtype=output_dtype),
+        output_core_dims=[['index']],
+        dask='parallelized',
+        output_dtypes=[output_dtype],
+        output_sizes={'index': len(indices)})
+
+    # Add each index as a new variable in dataset
+    if custom_varname is None:
+        output_band_names = indices
+    elif isinstance(custom_varname, str):
+        output_band_names = [custom_varname]
+    else:
+        output_band_names = custom_varname
+        
+    for i, output_band_name in enumerate(output_band_names):
+        ds[output_band_name] = index_arrays.isel(index=i)
+        if dtype == 'int16':
+            ds[output_band_name].attrs.update(scale_factor=1 / _INT16_SCALE,
+                                              nodata=_INT16_NODATA)
 
     # Return input dataset with added water index variable
     return ds
+
+
+def register_index(name, expression):
+    """
+    Adds a remote sensing index that can then be calculated using 
+    `calculate_indices(ds, index=name, ...)`.
+    
+    The index is given as a formula string, which is evaluated for each
+    pixel. Formulas can use band aliases (e.g. 'blue', 'green', 'red', 
+    'nir', 'swir1', 'swir2' after bands are renamed based on the 
+    `collection` passed to `calculate_indices`, or the name of any other 
+    variable in the dataset), numbers, arithmetic operators, comparisons,
+    the functions `sqrt`, `exp`, `log`, `abs` and `where`, and the names 
+    of other registered indices. Band values are scaled to 0.0-1.0 
+    before the formula is evaluated.
+    
+    Last modified: October 2026
+    
+    Parameters
+    ----------  
+    name : str
+        The name of the index (e.g. 'NDVI'). An existing index with the 
+        same name is replaced.
+    expression : str
+        The formula used to calculate the index, e.g. 
+        '(nir - red) / (nir + red)' or '3.618 * EVI - 0.118'.
+    """
+
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError:
+        raise ValueError(f"The formula '{expression}' for index '{name}' "
+                          "is not a valid expression")
+
+    # Only allow simple element-wise formulas that can be evaluated by 
+    # both numexpr and numpy
+    allowed_nodes = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, 
+                     ast.Call, ast.Name, ast.Load, ast.Constant, 
+                     *_EXPRESSION_OPERATORS)
+    function_names = set()
+    for node in ast.walk(tree):
+        if (not isinstance(node, allowed_nodes) or 
+                (isinstance(node, ast.Compare) and len(node.ops) > 1) or
+                (isinstance(node, ast.Constant) and 
+                 not isinstance(node.value, (int, float)))):
+            raise ValueError(f"The formula '{expression}' for index "
+                             f"'{name}' contains an unsupported "
+                             f"{type(node).__name__} expression")
+        if isinstance(node, ast.Call):
+            if (not isinstance(node.func, ast.Name) or node.keywords or
+                    node.func.id not in _EXPRESSION_FUNCTIONS):
+                raise ValueError(f"The formula '{expression}' for index "
+                                 f"'{name}' contains an unsupported "
+                                 f"function. Valid functions are "
+                                 f"{', '.join(_EXPRESSION_FUNCTIONS)}")
+            function_names.add(node.func.id)
+
+    # Names in the formula refer to either other indices or bands
+    names = []
+    for node in sorted((node for node in ast.walk(tree) 
+                        if isinstance(node, ast.Name)), 
+                       key=lambda node: (node.lineno, node.col_offset)):
+        if node.id not in function_names and node.id not in names:
+            names.append(node.id)
+    dependencies = [other for other in names 
+                    if other in _INDEX_EXPRESSIONS and other != name]
+    bands = [other for other in names if other not in dependencies]
+
+    if name in _index_dependencies(dependencies):
+        raise ValueError(f"The formula '{expression}' for index '{name}' "
+                         f"uses an index that itself uses '{name}'")
+
+    _INDEX_EXPRESSIONS[name] = (bands, expression.strip(), dependencies)
+
+
+def _index_dependencies(index_names):
+    """
+    Helper function for `calculate_indices` that returns `index_names` 
+    and all other indices they use, ordered so that each index comes 
+    after the indices it uses.
+    """
+
+    ordered = []
+
+    def visit(index_name):
+        if index_name not in ordered:
+            for dependency in _INDEX_EXPRESSIONS[index_name][2]:
+                visit(dependency)
+            ordered.append(index_name)
+
+    for index_name in index_names:
+        visit(index_name)
+
+    return ordered
+
+
+@lru_cache(maxsize=None)
+def _evaluation_steps(formulas):
+    """
+    Helper function for `calculate_indices` that converts a tuple of 
+    `(index_name, formula)` pairs into a list of `(name, formula)` 
+    steps to evaluate in order, and a tuple of the numbers used by the 
+    formulas. Any operation that occurs more than once in the formulas 
+    (e.g. `nir - red`) becomes its own step (e.g. `_term0`), which later 
+    steps use by name, and numbers are replaced with named variables 
+    (e.g. `_const0`) so they can be passed in with the same dtype as 
+    the bands.
+    """
+
+    trees = [(index_name, ast.parse(formula, mode='eval').body) 
+             for index_name, formula in formulas]
+    counts = Counter(ast.dump(node) for _, tree in trees 
+                     for node in ast.walk(tree) 
+                     if isinstance(node, ast.BinOp) and 
+                     any(isinstance(child, ast.Name) 
+                         for child in ast.walk(node)))
+    steps, terms, constants = [], {}, []
+
+    def to_source(node):
+        if isinstance(node, ast.Constant):
+            constants.append(float(node.value))
+            return f'_const{len(constants) - 1}'
+        if isinstance(node, ast.Name):
+            return node.id
+        if isinstance(node, ast.UnaryOp):
+            return (f'({_EXPRESSION_OPERATORS[type(node.op)]}'
+                    f'{to_source(node.operand)})')
+        if isinstance(node, ast.Compare):
+            return (f'({to_source(node.left)} '
+                    f'{_EXPRESSION_OPERATORS[type(node.ops[0])]} '
+                    f'{to_source(node.comparators[0])})')
+        if isinstance(node, ast.Call):
+            arguments = ', '.join(to_source(arg) for arg in node.args)
+            return f'{node.func.id}({arguments})'
+
+        # Operations that occur more than once are evaluated as a 
+        # separate step the first time they are used
+        key = ast.dump(node)
+        if key in terms:
+            return terms[key]
+        source = (f'({to_source(node.left)} '
+                  f'{_EXPRESSION_OPERATORS[type(node.op)]} '
+                  f'{to_source(node.right)})')
+        if counts[key] > 1:
+            terms[key] = f'_term{len(terms)}'
+            steps.append((terms[key], source))
+            return terms[key]
+        return source
+
+    for index_name, tree in trees:
+        steps.append((index_name, to_source(tree)))
+
+    return steps, tuple(constants)
+
+
+def _calculate_index_arrays(*band_arrays, band_names, nodata_values, 
+                            index_names, steps, constants, calc_dtype, 
+                            output_dtype):
+    """
+    Helper function for `calculate_indices` that evaluates a list of 
+    formula steps from numpy arrays of bands in `calc_dtype` precision,
+    returning an `output_dtype` array with the indices in `index_names` 
+    stacked along a new last axis. Bands are normalised to 0.0-1.0 by 
+    dividing by 10K only once, each step is evaluated once and can be 
+    used by later steps, and all indices are written into a single 
+    preallocated output array (scaled to integers if `output_dtype` is 
+    an integer).
+    """
+
+    # Normalise bands, setting any nodata values to NaN
+    variables = {f'_const{i}': calc_dtype.type(constant) 
+                 for i, constant in enumerate(constants)}
+    for band_name, band_array, nodata in zip(band_names, band_arrays, 
+                                             nodata_values):
+        variables[band_name] = (band_array.astype(calc_dtype) / 
+                                calc_dtype.type(1000.0))
+        if nodata is not None:
+            variables[band_name][band_array == nodata] = np.nan
+
+    # Evaluate each step, keeping its result for use by later steps
+    for name, expression in steps:
+        variables[name] = _evaluate_expression(expression, variables)
+
+    # Write each index into the preallocated output array
+    output = np.empty(band_arrays[0].shape + (len(index_names),), 
+                      dtype=output_dtype)
+    for i, index_name in enumerate(index_names):
+        index_array = variables[index_name]
+        if np.issubdtype(output_dtype, np.integer):
+            index_array = np.where(np.isnan(index_array), _INT16_NODATA,
+                                   np.clip(np.round(index_array * 
+                                                    _INT16_SCALE),
+                                           -32767, 32767))
+        output[..., i] = index_array
+
+    return output
+
+
+def _evaluate_expression(expression, variables):
+    """
+    Helper function for `calculate_indices` that evaluates a formula 
+    over a dictionary of named arrays and numbers, using numexpr if it 
+    is installed or numpy otherwise.
+    """
+
+    if numexpr is not None:
+        return numexpr.evaluate(expression, local_dict=variables)
+
+    return eval(_compile_expression(expression), 
+                {'__builtins__': {}, **_EXPRESSION_FUNCTIONS}, variables)
+
+
+@lru_cache(maxsize=None)
+def _compile_expression(expression):
+    """
+    Helper function for `_evaluate_expression` that compiles a formula 
+    to Python bytecode once, for evaluation using numpy.
+    """
+
+    return compile(expression, '<index>', 'eval')
+
+
+# Register the built-in remote sensing indices
+for _name, _expression in [
+        # Normalised Difference Vegation Index, Rouse 1973
+        ('NDVI', '(nir - red) / (nir + red)'),
+
+        # Enhanced Vegetation Index, Huete 2002
+        ('EVI', '2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1)'),
+
+        # Leaf Area Index, Boegh 2002
+        ('LAI', '3.618 * EVI - 0.118'),
+
+        # Soil Adjusted Vegetation Index, Huete 1988
+        ('SAVI', '1.5 * (nir - red) / (nir + red + 0.5)'),
+
+        # Normalised Difference Moisture Index, Gao 1996
+        ('NDMI', '(nir - swir1) / (nir + swir1)'),
+
+        # Normalised Burn Ratio, Lopez Garcia 1991
+        ('NBR', '(nir - swir2) / (nir + swir2)'),
+
+        # Burn Area Index, Martin 1998
+        ('BAI', '1.0 / ((0.10 - red) ** 2 + (0.06 - nir) ** 2)'),
+
+        # Normalised Difference Built-Up Index, Zha 2003
+        ('NDBI', '(swir1 - nir) / (swir1 + nir)'),
+
+        # Normalised Difference Snow Index, Hall 1995
+        ('NDSI', '(green - swir1) / (green + swir1)'),
+
+        # Normalised Difference Water Index, McFeeters 1996
+        ('NDWI', '(green - nir) / (green + nir)'),
+
+        # Modified Normalised Difference Water Index, Xu 2006
+        ('MNDWI', '(green - swir1) / (green + swir1)'),
+
+        # Automated Water Extraction Index (no shadows), Feyisa 2014
+        ('AWEI_ns', '4 * (green - swir1) - (2.5 * nir * 2.75 * swir2)'),
+
+        # Automated Water Extraction Index (shadows), Feyisa 2014
+        ('AWEI_sh', 
+         'blue + 2.5 * green - 1.5 * (nir + swir1) - 2.5 * swir2'),
+
+        # Water Index, Fisher 2016
+        ('WI', '1.7204 + 171 * green + 3 * red - 70 * nir - '
+               '45 * swir1 - 71 * swir2'),
+
+        # Clay Minerals Ratio, Drury 1987
+        ('CMR', 'swir1 / swir2'),
+
+        # Ferrous Minerals Ratio, Segal 1982
+        ('FMR', 'swir1 / nir'),
+
+        # Iron Oxide Ratio, Segal 1982
+        ('IOR', 'red / blue')]:
+    register_index(_name, _expression)
+
+# Tasseled Cap Wetness, Greeness and Brightness, Crist 1985
+for _name, _coefficients in _TC_COEFFICIENTS.items():
+    register_index(_name, ' + '.join(f'{coefficient} * {band}' for 
+                                     coefficient, band in 
+                                     zip(_coefficients, _TC_BANDS)))
@@ -13,9 +13,27 @@ Last modified: September 2019
 '''
 
 # Import required packages
+import os
+import sys
+import json
+import time
+import hashlib
+import inspect
 import numpy as np
 import xarray as xr
+from affine import Affine
 from datacube.storage import masking
+from datacube.api.query import (Query, query_group_by, SPATIAL_KEYS, 
+                                CRS_KEYS)
+from datacube.utils.geometry import CRS, GeoBox, Geometry
+from rasterio.features import geometry_mask
+
+# The resource module (used to report peak memory use) is not 
+# available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
 def load_ard(dc,
@@ -28,6 +46,14 @@ def load_ard(dc,
              product_metadata=False,
              dask_chunks={'time': 1},
              lazy_load=False,
+             preserve_dtype=False,
+             max_cloudcover=None,
+             cache_dir=None,
+             cache_size_gb=10,
+             dry_run=False,
+             max_memory_gb=None,
+             telemetry=None,
+             quicklook_size=None,
              **dcload_kwargs):
     '''
     Loads Landsat Collection 3 or Sentinel 2 Definitive and Near Real 
@@ -49,7 +75,9 @@ def load_ard(dc,
     These operations coerce all numeric values to float64 when NaN 
     values are inserted into the array, potentially causing your data 
     to use 4x as much memory. Be aware that the resulting arrays will 
-    contain invalid -999 values which may affect future analyses.
+    contain invalid -999 values which may affect future analyses. 
+    Alternatively, set `preserve_dtype=True` to mask data while keeping
+    the native int16 data type.
     
     Last modified: September 2019
     
@@ -101,16 +129,89 @@ def load_ard(dc,
         with a `product` variable that gives the name of the product 
         that each observation in the time series came from (e.g. 
         'ga_ls5t_ard_3'). Defaults to False.
-    dask_chunks : dict, optional
+    dask_chunks : dict or str, optional
         An optional dictionary containing the coords and sizes you wish 
         to create dask chunks over. Usually used in combination with 
         `lazy_load=True` (see below). For example: 
-        `dask_chunks = {'x': 500, 'y': 500}`
+        `dask_chunks = {'x': 500, 'y': 500}`. Set to 'auto' to choose 
+        chunks of approximately 100 MB based on the estimated size of 
+        the output (see `dry_run`).
     lazy_load : boolean, optional
         Setting this variable to True will delay the computation of the 
         function until you explicitly run `ds.compute()`. If used in 
         conjuction with `dask.distributed.Client()` this will allow for 
         automatic parallel computation.
+    preserve_dtype : bool, optional
+        An optional boolean indicating whether to keep the native data 
+        type (e.g. int16) of the output arrays. If True, poor quality 
+        pixels are set to each band's nodata value (e.g. -999) instead 
+        of NaN, invalid nodata values are left unchanged regardless of 
+        `mask_invalid_data`, and the good data mask is returned as a 
+        separate boolean `good_quality` variable (if 
+        `mask_pixel_quality=True`). Defaults to False.
+    max_cloudcover : float, optional
+        An optional float giving the maximum scene-level cloud cover 
+        percentage (0-100) allowed for an observation to be loaded, 
+        based on the `cloud_cover` metadata recorded for each dataset 
+        in the datacube index. This allows obviously cloudy scenes to 
+        be dropped before any pixels are read; the `min_gooddata` test 
+        is then only applied to the remaining observations. Because 
+        cloud cover is calculated over the entire scene rather than the 
+        area being loaded, this should be set conservatively (e.g. 90).
+        Datasets without cloud cover metadata are always loaded. 
+        Defaults to None, which loads all observations.
+    cache_dir : str, optional
+        An optional path to a directory used to cache results on disk. 
+        If provided, the output of each call is saved as a NetCDF file 
+        named after a hash of the products, query and masking options, 
+        and identical calls will read the cached file instead of 
+        loading data again. Cached results are reloaded if the datacube
+        index reports that datasets have been added or removed for the 
+        query. Defaults to None, which disables caching.
+    cache_size_gb : float, optional
+        The maximum total size of the files in `cache_dir` in gigabytes.
+        When this is exceeded, the least recently used cached results 
+        are deleted. Defaults to 10.
+    dry_run : bool, optional
+        An optional boolean indicating whether to estimate the size of 
+        the output instead of loading data. If True, the datacube index
+        is searched but no pixels are read, and a dict is returned 
+        giving the estimated number of `timesteps`, output array 
+        `shape`, size in `bytes` and suggested `dask_chunks`. 
+        The estimate is an upper bound, as it does not account for 
+        observations dropped by `min_gooddata`. Defaults to False.
+    max_memory_gb : float, optional
+        An optional maximum size of the output in gigabytes. If the 
+        estimated size of the output (see `dry_run`) is larger than 
+        this, an exception is raised before any data is loaded (or a 
+        warning is printed if `lazy_load=True`). Defaults to None.
+    telemetry : callable, optional
+        An optional function that is called with a dict describing 
+        each stage of the load, which can be used to record load times 
+        and data volumes in a machine-readable form (e.g. 
+        `telemetry=events.append` to collect events in a list, or 
+        `telemetry=logger.info` to log them). Each dict has an `event` 
+        key: 'product' events are emitted for each product and include
+        `query_time` (index search and load setup), `filter_time` 
+        (reading fmask and filtering), `mask_time`, `obs_total`, 
+        `obs_filtered` and `output_bytes` (in-memory size of the 
+        filtered output, not bytes read from disk); a 'combine' event 
+        gives `combine_time` and `obs_total`; and a 'compute' event 
+        gives `compute_time`, `output_bytes` and the peak memory use of 
+        the process in `peak_memory_mb` (None where this is not 
+        available, e.g. on Windows). Defaults to None, which disables 
+        telemetry.
+    quicklook_size : int, optional
+        An optional maximum size in pixels of the output's width and 
+        height, used to quickly load low resolution previews (e.g. for 
+        `rgb` or `animated_timeseries`) of large areas. If the query 
+        would return a larger array, data is loaded on a coarser pixel 
+        grid covering the same extent, with a pixel size that is a 
+        whole multiple of the full resolution. Bands are resampled 
+        using 'average' (reading from overviews where the source data 
+        has them) and `fmask` using 'nearest', so masking and 
+        filtering work as normal. Defaults to None, which loads data at
+        full resolution.
     **dcload_kwargs : 
         A set of keyword arguments to `dc.load` that define the 
         spatiotemporal query used to extract data. This can include `x`,
@@ -142,7 +243,74 @@ def load_ard(dc,
     # If `measurements` are specified but do not include fmask, add it
     if (('measurements' in dcload_kwargs) and 
         ('fmask' not in dcload_kwargs['measurements'])):
-        dcload_kwargs['measurements'].append('fmask')
+        dcload_kwargs['measurements'] = (list(dcload_kwargs['measurements']) 
+                                         + ['fmask'])
+
+    # Optionally load a low resolution preview by replacing the query's
+    # pixel grid with a coarser grid covering the same extent
+    if quicklook_size is not None:
+        dcload_kwargs = _quicklook_kwargs(dc, products, dcload_kwargs,
+                                          quicklook_size)
+
+    # Search the datacube index once for each product. These datasets 
+    # are reused for cache validation, size estimates, cloud cover 
+    # screening and loading, rather than repeating the search each time
+    product_datasets = {product: _find_datasets(dc, product, dcload_kwargs)
+                        for product in products}
+
+    # Optionally estimate the size of the output without reading any 
+    # pixels, and use this to plan dask chunks and check memory use
+    if dry_run or (max_memory_gb is not None) or (dask_chunks == 'auto'):
+        estimate = _estimate_load(dc, products, product_datasets, 
+                                  dcload_kwargs,
+                                  float_output=(mask_pixel_quality or 
+                                                mask_invalid_data) and 
+                                               not preserve_dtype)
+        print(f'Estimated output: {estimate["timesteps"]} timesteps, '
+              f'{estimate["bytes"] / 1e9:.2f} GB')
+
+        if dry_run:
+            return estimate
+
+        if (max_memory_gb is not None and 
+            estimate['bytes'] > max_memory_gb * 1e9):
+            message = (f'Estimated output size of '
+                       f'{estimate["bytes"] / 1e9:.2f} GB exceeds '
+                       f'`max_memory_gb` of {max_memory_gb} GB. Consider '
+                       f'reducing the extent or time range of the query, '
+                       f'or using `load_ard_tiled`')
+            if lazy_load:
+                print(f'    Warning: {message}')
+            else:
+                raise MemoryError(message)
+
+        if dask_chunks == 'auto':
+            dask_chunks = estimate['dask_chunks']
+            print(f'    Using dask chunks {dask_chunks}')
+
+    # If a cache directory is given, return previously cached results 
+    # for an identical call if no datasets have since been indexed. This
+    # is checked after the size estimate so that dry runs never load 
+    # data and `max_memory_gb` also applies to cached results
+    if cache_dir:
+        cache_path = _cache_path(cache_dir,
+                                 products=sorted(products),
+                                 min_gooddata=min_gooddata,
+                                 fmask_gooddata=sorted(fmask_gooddata),
+                                 mask_pixel_quality=mask_pixel_quality,
+                                 mask_invalid_data=mask_invalid_data,
+                                 ls7_slc_off=ls7_slc_off,
+                                 product_metadata=product_metadata,
+                                 preserve_dtype=preserve_dtype,
+                                 max_cloudcover=max_cloudcover,
+                                 dcload_kwargs=dcload_kwargs)
+        datasets_hash = _datasets_hash(product_datasets)
+        cached_ds = _read_cache(cache_path, datasets_hash, dask_chunks)
+
+        if cached_ds is not None:
+            print(f'Loading {len(cached_ds.time)} cached observations '
+                  f'from {cache_path}')
+            return cached_ds if lazy_load else cached_ds.load()
 
     # Create a list to hold data for each product
     product_data = []
@@ -152,12 +320,33 @@ def load_ard(dc,
 
         try:
 
+            # Optionally drop cloudy scenes using dataset metadata before 
+            # reading any pixels, and load only the remaining datasets
+            start_time = time.perf_counter()
+            datasets = product_datasets[product]
+            if max_cloudcover is not None:
+                clear_datasets = [
+                    dataset for dataset in datasets
+                    if getattr(dataset.metadata, 'cloud_cover', None) is None
+                    or dataset.metadata.cloud_cover <= max_cloudcover
+                ]
+                print(f'Keeping {len(clear_datasets)} out of '
+                      f'{len(datasets)} {product} datasets with '
+                      f'<= {max_cloudcover}% cloud cover')
+                datasets = clear_datasets
+
+            if not datasets:
+                print(f'    No data for {product}')
+                continue
+
+            product_kwargs = dict(dcload_kwargs, datasets=datasets)
+
             # Load data including fmask band
             print(f'Loading {product} data')
             try:
                 ds = dc.load(product=f'{product}',
                              dask_chunks=dask_chunks,
-                             **dcload_kwargs)
+                             **product_kwargs)
             except KeyError as e:
                 raise ValueError(f'Band {e} does not exist in this product. '
                                  f'Verify all requested `measurements` exist '
@@ -165,6 +354,7 @@ def load_ard(dc,
             
             # Keep a record of the original number of observations
             total_obs = len(ds.time)
+            query_time = time.perf_counter() - start_time
 
             # Remove Landsat 7 SLC-off observations if ls7_slc_off=False
             if not ls7_slc_off and product == 'ga_ls7e_ard_3':
@@ -176,25 +366,38 @@ def load_ard(dc,
             if 'oa_fmask' in ds:
                 ds = ds.rename({'oa_fmask': 'fmask'})
 
-            # Identify all pixels not affected by cloud/shadow/invalid
-            good_quality = np.isin(ds.fmask,
-                                   test_elements=fmask_gooddata)
-            good_quality = ds.fmask.where(good_quality).notnull()
-
-            # Compute good data for each observation as % of total pixels
-            data_perc = good_quality.sum(axis=1).sum(
-                axis=1) / (good_quality.shape[1] * good_quality.shape[2])
+            # Identify all pixels not affected by cloud/shadow/invalid, 
+            # and compute good data for each observation as % of total 
+            # pixels in the same pass
+            good_quality, data_perc = _fmask_good_data(ds.fmask,
+                                                       fmask_gooddata)
 
             # Filter by data_perc to drop low quality observations
             filtered = ds.sel(time=data_perc >= min_gooddata)
             print(f'    Filtering to {len(filtered.time)} '
                   f'out of {total_obs} observations')
+            filter_time = time.perf_counter() - start_time - query_time
 
             # Optionally apply pixel quality mask to all observations that
-            # were not dropped in previous step
+            # were not dropped in previous step. If `preserve_dtype=True`,
+            # set poor quality pixels to nodata instead of NaN
             if mask_pixel_quality & (len(filtered.time) > 0):
                 print('    Applying pixel quality mask')
-                filtered = filtered.where(good_quality)
+                if preserve_dtype:
+                    filtered = _mask_to_nodata(filtered, good_quality)
+                else:
+                    filtered = filtered.where(good_quality)
+            mask_time = (time.perf_counter() - start_time - query_time - 
+                         filter_time)
+
+            _emit(telemetry, 'product', 
+                  product=product,
+                  query_time=query_time, 
+                  filter_time=filter_time,
+                  mask_time=mask_time, 
+                  obs_total=total_obs, 
+                  obs_filtered=len(filtered.time),
+                  output_bytes=filtered.nbytes)
 
             # Optionally add satellite name
             if product_metadata:
@@ -213,15 +416,28 @@ def load_ard(dc,
     # If any data was returned above, combine into one xarray
     if (len(product_data) > 0):
 
-        # Concatenate results and sort by time
+        # Merge results into a single dataset sorted by time
         print(f'Combining and sorting data')
-        combined_ds = xr.concat(product_data, dim='time').sortby('time')
+        start_time = time.perf_counter()
+        combined_ds = _merge_by_time(product_data)
+        _emit(telemetry, 'combine', 
+              combine_time=time.perf_counter() - start_time,
+              obs_total=len(combined_ds.time))
 
         # Optionally filter to replace no data values with nans
-        if mask_invalid_data:
+        if mask_invalid_data and not preserve_dtype:
             print('    Masking out invalid values')
             combined_ds = masking.mask_invalid_data(combined_ds)
 
+        # Optionally save results to the cache, and re-open lazily from
+        # the cache so that the data is not loaded twice
+        if cache_dir:
+            print(f'    Writing results to cache {cache_path}')
+            _write_cache(combined_ds, cache_path, datasets_hash,
+                         cache_size_gb)
+            combined_ds = _read_cache(cache_path, datasets_hash, 
+                                      dask_chunks)
+
         # If `lazy_load` is True, return data as a dask array without
         # actually loading it in
         if lazy_load:
@@ -231,9 +447,756 @@ def load_ard(dc,
 
         else:
             print(f'    Returning {len(combined_ds.time)} observations ')
-            return combined_ds.compute()
+            start_time = time.perf_counter()
+            combined_ds = combined_ds.compute()
+            _emit(telemetry, 'compute',
+                  compute_time=time.perf_counter() - start_time,
+                  output_bytes=combined_ds.nbytes,
+                  peak_memory_mb=_peak_memory_mb())
+            return combined_ds
 
     # If no data was returned:
     else:
         print('No data returned for query')
         return None
+
+
+def load_ard_tiled(dc,
+                   products=None,
+                   tile_size=(2000, 2000),
+                   tile_overlap=0,
+                   **load_ard_kwargs):
+    '''
+    Splits the extent of a `load_ard` query into spatial tiles, and 
+    loads masked, filtered and time-sorted data for one tile at a time.
+    This is a generator: each tile is only loaded when it is requested 
+    (e.g. in a `for` loop), so memory use depends on `tile_size` rather
+    than on the size of the entire study area.
+    
+    Tiles are aligned to the same pixel grid that `load_ard` would use 
+    for the entire extent, so results can be mosaicked back together.
+    
+    Last modified: October 2026
+    
+    Parameters
+    ----------  
+    dc : datacube Datacube object
+        The Datacube to connect to, i.e. `dc = datacube.Datacube()`.
+        This allows you to also use development datacubes if required.    
+    products : list
+        A list of product names to load data from (see `load_ard`).
+    tile_size : tuple, optional
+        The size of each tile in pixels, as a `(y, x)` tuple. Defaults 
+        to `(2000, 2000)`.
+    tile_overlap : int, optional
+        An optional number of pixels to extend each tile by on every 
+        side (clipped to the edge of the full extent). This can be used 
+        to avoid edge effects when running neighbourhood operations 
+        (e.g. extracting contours) on each tile. Defaults to 0.
+    **load_ard_kwargs : 
+        Any other keyword arguments to `load_ard`, including the 
+        spatiotemporal query used to extract data. The query must 
+        include `output_crs` and `resolution` unless the products have 
+        a default grid, and can include `align`.
+        
+    Yields
+    ------
+    tile_ds : xarray Dataset
+        An xarray dataset for each tile, as returned by `load_ard`. 
+        Tiles with no data are skipped.
+        
+    '''
+
+    # Identify the grid of pixels for the entire query extent. Spatial 
+    # query parameters are then replaced by a `like` geobox per tile
+    geobox = _query_geobox(dc, products, load_ard_kwargs)
+    tile_kwargs = {key: value for key, value in load_ard_kwargs.items() 
+                   if key not in ('x', 'y', 'lon', 'lat', 'longitude', 
+                                  'latitude', 'crs', 'geopolygon', 
+                                  'output_crs', 'resolution', 'align', 
+                                  'like')}
+
+    # Load and yield each tile, including any overlap
+    height, width = geobox.shape
+    for y_start in range(0, height, tile_size[0]):
+        for x_start in range(0, width, tile_size[1]):
+
+            y_slice = slice(max(y_start - tile_overlap, 0),
+                            min(y_start + tile_size[0] + tile_overlap, 
+                                height))
+            x_slice = slice(max(x_start - tile_overlap, 0),
+                            min(x_start + tile_size[1] + tile_overlap, 
+                                width))
+
+            print(f'Loading tile y={y_slice.start}:{y_slice.stop}, '
+                  f'x={x_slice.start}:{x_slice.stop} of {height}x{width}')
+            tile_ds = load_ard(dc=dc, 
+                               products=products, 
+                               like=geobox[y_slice, x_slice], 
+                               **tile_kwargs)
+
+            if tile_ds is not None:
+                yield tile_ds
+
+
+def load_ard_polygons(dc,
+                      gdf,
+                      products=None,
+                      group_size=(2000, 2000),
+                      **load_ard_kwargs):
+    '''
+    Loads masked, filtered and time-sorted data for many polygons (e.g.
+    waterbodies or fields) in a GeoDataFrame using a small number of 
+    `load_ard` calls. Neighbouring polygons are grouped into blocks of
+    up to approximately `group_size` pixels, and each block is queried 
+    and read from disk once. Data for each polygon is then clipped from 
+    its block, masked to the polygon outline, and filtered to remove 
+    observations with less than `min_gooddata` good quality pixels 
+    within the polygon.
+    
+    This is a generator: each block is only loaded when its first 
+    polygon is requested (e.g. in a `for` loop), so memory use depends 
+    on `group_size` rather than on the extent of all polygons.
+    
+    Last modified: October 2026
+    
+    Parameters
+    ----------  
+    dc : datacube Datacube object
+        The Datacube to connect to, i.e. `dc = datacube.Datacube()`.
+        This allows you to also use development datacubes if required.    
+    gdf : geopandas GeoDataFrame
+        A GeoDataFrame of polygons to load data for. It must have a 
+        coordinate reference system (i.e. `gdf.crs`) set.
+    products : list
+        A list of product names to load data from (see `load_ard`).
+    group_size : tuple, optional
+        The approximate size in pixels of the blocks that polygons are 
+        grouped into, as a `(y, x)` tuple. Blocks are extended to cover 
+        all of each polygon, so may be larger for large polygons. 
+        Defaults to `(2000, 2000)`.
+    **load_ard_kwargs : 
+        Any other keyword arguments to `load_ard` (e.g. `time`, 
+        `measurements` or `min_gooddata`). The query must include 
+        `output_crs` and `resolution` unless the products have a 
+        default grid, and can include `align`. Spatial query parameters 
+        (e.g. `x` and `y`) are ignored, as the extent is taken from 
+        `gdf`. Filtering by `min_gooddata` requires 
+        `mask_pixel_quality=True` (the default).
+        
+    Yields
+    ------
+    index, polygon_ds : tuple
+        The index of each polygon in `gdf`, and an xarray dataset for
+        the polygon with pixels outside the polygon masked out. Polygons 
+        with no data are skipped.
+        
+    '''
+
+    min_gooddata = load_ard_kwargs.pop('min_gooddata', 0.0)
+    if min_gooddata > 0 and not load_ard_kwargs.get('mask_pixel_quality',
+                                                    True):
+        raise ValueError("Filtering polygons by `min_gooddata` requires "
+                         "`mask_pixel_quality=True`")
+
+    # Identify the grid of pixels covering all polygons. Spatial query
+    # parameters are then replaced by a `like` geobox per block
+    geopolygon = Geometry(gdf.unary_union.__geo_interface__, 
+                          crs=CRS(gdf.crs.to_wkt()))
+    query_kwargs = {key: value for key, value in load_ard_kwargs.items() 
+                    if key not in ('x', 'y', 'lon', 'lat', 'longitude', 
+                                   'latitude', 'crs', 'geopolygon')}
+    geobox = _query_geobox(dc, products, 
+                           dict(query_kwargs, geopolygon=geopolygon))
+    block_kwargs = {key: value for key, value in query_kwargs.items() 
+                    if key not in ('output_crs', 'resolution', 'align', 
+                                   'like')}
+
+    # Find the pixel window covering each polygon, and group polygons 
+    # into blocks by the position of the top-left corner of the window
+    gdf = gdf.to_crs(geobox.crs.wkt)
+    windows = _polygon_windows(gdf, geobox)
+    blocks = {}
+    for index, (y_slice, x_slice) in windows.items():
+        block_id = (y_slice.start // group_size[0], 
+                    x_slice.start // group_size[1])
+        blocks.setdefault(block_id, []).append(index)
+
+    # Load each block once, then clip, mask and filter each polygon
+    print(f'Grouped {len(gdf)} polygons into {len(blocks)} blocks')
+    y_dim, x_dim = geobox.dimensions
+    for block_number, indices in enumerate(blocks.values()):
+
+        block_y = slice(min(windows[i][0].start for i in indices),
+                        max(windows[i][0].stop for i in indices))
+        block_x = slice(min(windows[i][1].start for i in indices),
+                        max(windows[i][1].stop for i in indices))
+
+        print(f'Loading block {block_number + 1} of {len(blocks)} '
+              f'({len(indices)} polygons)')
+        block_ds = load_ard(dc=dc, 
+                            products=products, 
+                            like=geobox[block_y, block_x], 
+                            **block_kwargs)
+
+        if block_ds is None:
+            continue
+
+        for index in indices:
+            y_slice, x_slice = windows[index]
+            polygon_ds = block_ds.isel(
+                **{y_dim: slice(y_slice.start - block_y.start, 
+                                y_slice.stop - block_y.start),
+                   x_dim: slice(x_slice.start - block_x.start, 
+                                x_slice.stop - block_x.start)})
+
+            # Rasterise the polygon onto the pixels of its window
+            polygon_geobox = geobox[y_slice, x_slice]
+            inside = xr.DataArray(
+                geometry_mask([gdf.geometry[index]], 
+                              out_shape=polygon_geobox.shape,
+                              transform=polygon_geobox.affine, 
+                              invert=True),
+                coords=[polygon_ds[y_dim], polygon_ds[x_dim]])
+
+            polygon_ds = _mask_polygon(
+                polygon_ds, inside, min_gooddata,
+                preserve_dtype=load_ard_kwargs.get('preserve_dtype', 
+                                                   False))
+
+            if len(polygon_ds.time) > 0:
+                yield index, polygon_ds
+
+
+def load_ard_incremental(dc,
+                         state_path,
+                         products=None,
+                         overlap_days=1,
+                         **load_ard_kwargs):
+    '''
+    Keeps a rolling time window of `load_ard` results up to date while 
+    only reading new observations, for example to refresh a trailing 
+    90 day window of Sentinel 2 Near Real Time data every day. 
+    
+    The previous result is stored in a NetCDF file at `state_path`, 
+    along with the time of the latest dataset seen in the datacube 
+    index. Each call searches the index only for datasets acquired 
+    since the start of the day `overlap_days` before this time, loads, 
+    masks and filters just those observations using `load_ard`, and 
+    uses them to replace any previous observations in this overlap 
+    window. Re-loading the overlap window picks up datasets that were 
+    indexed late, and ensures observations from the same solar day are 
+    grouped together rather than stored twice. Observations that are 
+    now earlier than the start of the `time` range are dropped, and 
+    the updated result is saved back to `state_path`. If `state_path` 
+    does not exist or was created with different parameters, the 
+    entire time range is loaded.
+    
+    Last modified: October 2026
+    
+    Parameters
+    ----------  
+    dc : datacube Datacube object
+        The Datacube to connect to, i.e. `dc = datacube.Datacube()`.
+        This allows you to also use development datacubes if required.    
+    state_path : str
+        Path to the NetCDF file used to store the result between calls.
+    products : list
+        A list of product names to load data from (see `load_ard`).
+    overlap_days : int, optional
+        The number of days before the latest dataset seen on the 
+        previous call that are searched and loaded again, to pick up 
+        datasets that were indexed late. Defaults to 1, which re-loads 
+        the last solar day. Datasets indexed late that were acquired 
+        before this overlap window are not loaded.
+    **load_ard_kwargs : 
+        Any other keyword arguments to `load_ard`, including the 
+        spatiotemporal query used to extract data. The query must 
+        include a `time` range given as a `(start, end)` tuple; the 
+        start of this range is used to drop old observations.
+        
+    Returns
+    -------
+    combined_ds : xarray Dataset
+        An xarray dataset containing all observations in the `time` 
+        range, as returned by `load_ard`, or None if there are no 
+        observations.
+        
+    '''
+
+    time_range = load_ard_kwargs.get('time')
+    if not isinstance(time_range, (tuple, list)) or len(time_range) != 2:
+        raise ValueError("Please provide a `time` range as a "
+                         "`(start, end)` tuple")
+
+    # Identify results previously loaded with identical parameters
+    params_hash = _params_hash(
+        products=sorted(products),
+        load_ard_kwargs={key: value for key, value in 
+                         load_ard_kwargs.items() if key != 'time'})
+    previous_ds, latest_time = None, None
+    if os.path.exists(state_path):
+        with _open_netcdf(state_path) as state_ds:
+            if state_ds.attrs.pop('incremental_params_hash', 
+                                  None) == params_hash:
+                latest_time = np.datetime64(
+                    state_ds.attrs.pop('incremental_latest_time'))
+                previous_ds = state_ds.load()
+
+    # Search only for datasets acquired since the start of the overlap 
+    # window before the latest dataset seen
+    query_start = np.datetime64(time_range[0], 's')
+    if latest_time is not None:
+        query_start = max(query_start, 
+                          (latest_time - np.timedelta64(overlap_days, 'D'))
+                          .astype('datetime64[D]').astype('datetime64[s]'))
+    query_kwargs = dict(load_ard_kwargs, 
+                        time=(str(query_start), time_range[1]))
+
+    # Search using only the `dc.load` query, without `load_ard`'s own 
+    # parameters (e.g. `min_gooddata`)
+    load_ard_params = inspect.signature(load_ard).parameters
+    search_kwargs = {key: value for key, value in query_kwargs.items() 
+                     if key not in load_ard_params}
+    new_times = [_dataset_time(dataset) for product in products 
+                 for dataset in _find_datasets(dc, product, search_kwargs)]
+    print(f'Found {len(new_times)} datasets since {query_start}')
+
+    # Keep previous observations that are still in the time range and 
+    # earlier than the overlap window, which is loaded again below
+    results = []
+    if previous_ds is not None and 'time' in previous_ds.dims:
+        results.append(previous_ds.sel(
+            time=((previous_ds.time >= np.datetime64(time_range[0])) & 
+                  (previous_ds.time < query_start))))
+
+    # Load, mask and filter only the observations in the overlap window 
+    # and any new observations
+    if new_times:
+        latest_time = max(new_times + ([latest_time] if latest_time 
+                                       is not None else []))
+        new_ds = load_ard(dc=dc, products=products, **query_kwargs)
+        if new_ds is not None:
+            results.append(new_ds)
+
+    # Combine with the remaining previous observations, keeping only the 
+    # newly loaded observation if any times are duplicated, and save
+    results = [ds for ds in results if len(ds.time) > 0]
+    combined_ds = _merge_by_time(results) if results else None
+    if combined_ds is not None:
+        combined_ds = combined_ds.isel(
+            time=~combined_ds.indexes['time'].duplicated(keep='last'))
+    _write_netcdf(combined_ds if combined_ds is not None else xr.Dataset(),
+                  state_path,
+                  incremental_params_hash=params_hash,
+                  incremental_latest_time=str(latest_time if latest_time 
+                                              is not None else 
+                                              query_start))
+
+    return combined_ds
+
+
+def _find_datasets(dc, product, dcload_kwargs):
+    """
+    Helper function for `load_ard` that searches the datacube index 
+    for the datasets of `product` matching a `dc.load` query. Only 
+    spatial, time and index search keywords are used for the search; 
+    all other keywords (e.g. `output_crs`, `skip_broken_datasets`) only
+    apply to loading. The result can be passed to `dc.load` using 
+    `datasets`.
+    """
+
+    search_keys = (set(SPATIAL_KEYS + CRS_KEYS) | 
+                   {'geopolygon', 'like', 'time', 'source_filter'} | 
+                   dc.index.datasets.get_field_names(product))
+    search_terms = {key: value for key, value in dcload_kwargs.items() 
+                    if key in search_keys and key != 'product'}
+
+    return dc.find_datasets(product=product, **search_terms)
+
+
+def _emit(telemetry, event, **fields):
+    """
+    Helper function for `load_ard` that passes a telemetry event to the
+    `telemetry` function, if one was provided.
+    """
+
+    if telemetry is not None:
+        telemetry(dict(event=event, **fields))
+
+
+def _peak_memory_mb():
+    """
+    Helper function for `load_ard` that returns the peak memory use of 
+    the process in megabytes, or None where this is not available 
+    (e.g. on Windows).
+    """
+
+    if resource is None:
+        return None
+
+    # `ru_maxrss` is given in bytes on macOS, and kilobytes elsewhere
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (peak_memory / 1024 ** 2 if sys.platform == 'darwin' 
+            else peak_memory / 1024)
+
+
+def _query_geobox(dc, products, dcload_kwargs):
+    """
+    Helper function that returns the geobox (pixel grid) that `dc.load`
+    would use for a query, using `output_crs` and `resolution` from the 
+    query or otherwise the default grid of the first product.
+    """
+
+    if 'like' in dcload_kwargs:
+        like = dcload_kwargs['like']
+        return like if isinstance(like, GeoBox) else like.geobox
+
+    output_crs = dcload_kwargs.get('output_crs')
+    resolution = dcload_kwargs.get('resolution')
+    if output_crs is None or resolution is None:
+        grid_spec = dc.index.products.get_by_name(products[0]).grid_spec
+        if grid_spec is None:
+            raise ValueError("Please provide both `output_crs` and "
+                             "`resolution` in the query, as the product "
+                             "does not have a default grid")
+        output_crs = output_crs or grid_spec.crs
+        resolution = resolution or grid_spec.resolution
+
+    geopolygon = Query(**{key: value for key, value in 
+                          dcload_kwargs.items() if key in 
+                          ('x', 'y', 'lon', 'lat', 'longitude', 
+                           'latitude', 'crs', 'geopolygon')}).geopolygon
+    return GeoBox.from_geopolygon(geopolygon,
+                                  resolution=resolution,
+                                  crs=CRS(str(output_crs)),
+                                  align=dcload_kwargs.get('align'))
+
+
+def _estimate_load(dc, products, product_datasets, dcload_kwargs, 
+                   float_output, target_chunk_mb=100):
+    """
+    Helper function for `load_ard` that estimates the number of 
+    timesteps, output shape and size in bytes of a load using only the 
+    datasets found in the datacube index for each product, and 
+    suggests dask chunks of approximately `target_chunk_mb` megabytes 
+    per band.
+    """
+
+    # Count timesteps after grouping datasets as `dc.load` would
+    group_by = query_group_by(group_by=dcload_kwargs.get('group_by', 
+                                                          'time'))
+    timesteps = sum(len(dc.group_datasets(datasets, group_by).time)
+                    for datasets in product_datasets.values() 
+                    if datasets)
+
+    # Get data type of each band that will be returned (including 
+    # aliases) from the first product's measurement definitions
+    measurements = dc.index.products.get_by_name(products[0]).measurements
+    band_dtypes = {}
+    for name, measurement in measurements.items():
+        for alias in [name] + list(measurement.get('aliases', [])):
+            band_dtypes[alias] = np.dtype(measurement['dtype'])
+    bands = [band for band in dcload_kwargs.get('measurements', 
+                                                 measurements.keys())
+             if band not in ('fmask', 'oa_fmask')]
+    itemsizes = [8 if float_output else band_dtypes[band].itemsize
+                 for band in bands if band in band_dtypes]
+
+    # Estimate output size
+    height, width = _query_geobox(dc, products, dcload_kwargs).shape
+    n_bytes = timesteps * height * width * sum(itemsizes)
+
+    # Suggest chunks: whole timesteps if several fit into one chunk, 
+    # otherwise single timesteps split into square spatial chunks
+    target_bytes = target_chunk_mb * 1e6
+    pixel_bytes = max(itemsizes, default=8)
+    timestep_bytes = height * width * pixel_bytes
+    if timestep_bytes <= target_bytes:
+        dask_chunks = {'time': max(1, int(target_bytes // timestep_bytes))}
+    else:
+        side = int(np.sqrt(target_bytes / pixel_bytes))
+        dask_chunks = {'time': 1, 'x': side, 'y': side}
+
+    return {'timesteps': timesteps,
+            'shape': (timesteps, height, width),
+            'bytes': n_bytes,
+            'dask_chunks': dask_chunks}
+
+
+def _params_hash(**params):
+    """
+    Helper function that returns a hash of a set of function 
+    parameters, used to identify results loaded with the same options.
+    """
+
+    params_str = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(params_str.encode()).hexdigest()
+
+
+def _cache_path(cache_dir, **params):
+    """
+    Helper function for `load_ard` that returns the path of the cache 
+    file for a call, named using a hash of the call's parameters.
+    """
+
+    return os.path.join(cache_dir, f'{_params_hash(**params)}.nc')
+
+
+def _datasets_hash(product_datasets):
+    """
+    Helper function for `load_ard` that returns a hash of the IDs of 
+    all datasets found in the index for each product, used to 
+    invalidate cached results when datasets are added or removed.
+    """
+
+    dataset_ids = sorted(str(dataset.id) 
+                         for datasets in product_datasets.values()
+                         for dataset in datasets)
+    return hashlib.sha256(','.join(dataset_ids).encode()).hexdigest()
+
+
+def _read_cache(cache_path, datasets_hash, dask_chunks):
+    """
+    Helper function for `load_ard` that lazily opens a cached result, 
+    or returns None if there is no cached result or it is out of date.
+    """
+
+    if not os.path.exists(cache_path):
+        return None
+
+    ds = _open_netcdf(cache_path, dask_chunks)
+    if ds.attrs.pop('cache_datasets_hash', None) != datasets_hash:
+        ds.close()
+        return None
+
+    # Mark as recently used
+    os.utime(cache_path)
+    return ds
+
+
+def _write_cache(ds, cache_path, datasets_hash, cache_size_gb):
+    """
+    Helper function for `load_ard` that writes a result to the cache, 
+    then deletes the least recently used cached results until the 
+    cache is smaller than `cache_size_gb`.
+    """
+
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    _write_netcdf(ds, cache_path, cache_datasets_hash=datasets_hash)
+
+    # Delete least recently used results until cache is small enough
+    cache_files = sorted((os.path.join(cache_dir, file_name) 
+                          for file_name in os.listdir(cache_dir)
+                          if file_name.endswith('.nc')),
+                         key=os.path.getmtime)
+    cache_bytes = sum(os.path.getsize(file) for file in cache_files)
+
+    for file in cache_files:
+        if (cache_bytes <= cache_size_gb * 1e9) or (file == cache_path):
+            break
+        cache_bytes -= os.path.getsize(file)
+        os.remove(file)
+
+
+def _open_netcdf(path, dask_chunks=None):
+    """
+    Helper function that opens a NetCDF file written by `_write_netcdf`,
+    restoring CRS attributes to datacube CRS objects.
+    """
+
+    ds = xr.open_dataset(path, chunks=dask_chunks)
+    for attrs in [ds.attrs] + [var.attrs for var in ds.variables.values()]:
+        if 'crs' in attrs:
+            attrs['crs'] = CRS(attrs['crs'])
+
+    return ds
+
+
+def _write_netcdf(ds, path, **attrs):
+    """
+    Helper function that writes a dataset to a NetCDF file with extra 
+    global `attrs`, converting attributes that cannot be stored in 
+    NetCDF (e.g. CRS objects) to strings. The file is written to a 
+    temporary path first, so a partially written file is never read.
+    """
+
+    # NetCDF attributes must be strings or numbers (e.g. not CRS objects)
+    def _netcdf_attrs(attrs):
+        return {key: value if isinstance(value, (str, int, float, np.number))
+                else str(value) for key, value in attrs.items()}
+
+    ds_out = ds.copy()
+    ds_out.attrs = _netcdf_attrs(dict(ds.attrs, **attrs))
+    for var in ds_out.variables.values():
+        var.attrs = _netcdf_attrs(var.attrs)
+
+    temp_path = f'{path}.tmp'
+    ds_out.to_netcdf(temp_path)
+    os.replace(temp_path, path)
+
+
+def _dataset_time(dataset):
+    """
+    Helper function for `load_ard_incremental` that returns the 
+    acquisition time of a datacube dataset as a UTC numpy datetime64.
+    """
+
+    return np.datetime64(dataset.center_time.replace(tzinfo=None), 's')
+
+
+def _fmask_good_data(fmask, fmask_gooddata):
+    """
+    Helper function for `load_ard` that identifies good quality pixels
+    in `fmask` using a lookup table of the values in `fmask_gooddata`, 
+    chunk by chunk if `fmask` is a dask array. Returns a boolean good 
+    quality mask and the proportion of good quality pixels for each 
+    timestep, without creating any floating point copies of `fmask`.
+    """
+
+    # Lookup table giving whether each possible fmask value is good data
+    lookup_table = np.zeros(256, dtype=bool)
+    lookup_table[np.asarray(fmask_gooddata, dtype=np.uint8)] = True
+
+    def _lookup(fmask_values):
+        return lookup_table[fmask_values.astype(np.uint8)]
+
+    good_quality = xr.apply_ufunc(_lookup, fmask, 
+                                  dask='parallelized', 
+                                  output_dtypes=[bool])
+
+    # Compute good data for each observation as % of total pixels
+    data_perc = good_quality.sum(axis=1).sum(
+        axis=1) / (good_quality.shape[1] * good_quality.shape[2])
+
+    return good_quality, data_perc
+
+
+def _mask_to_nodata(ds, good_quality):
+    """
+    Helper function for `load_ard` that sets pixels outside 
+    `good_quality` to each variable's nodata value without changing 
+    its data type. Variables without a `nodata` attribute are left 
+    unchanged, and the mask is added to the output as a boolean 
+    `good_quality` variable.
+    """
+
+    masked_ds = ds.copy()
+    good_quality = good_quality.sel(time=ds.time)
+
+    for var_name, var in ds.data_vars.items():
+        if 'nodata' in var.attrs:
+            nodata = np.array(var.attrs['nodata'], dtype=var.dtype)
+            masked_ds[var_name] = (var.where(good_quality, nodata)
+                                   .assign_attrs(var.attrs))
+
+    masked_ds['good_quality'] = good_quality
+    return masked_ds
+
+
+def _merge_by_time(datasets):
+    """
+    Helper function that combines datasets into a single dataset 
+    sorted by time. Data loaded by `load_ard` is always lazy (dask), so 
+    concatenating and sorting only builds a dask graph, and each 
+    timestep is copied once when the result is computed.
+    """
+
+    return xr.concat(list(datasets), dim='time').sortby('time')
+
+
+def _polygon_windows(gdf, geobox):
+    """
+    Helper function for `load_ard_polygons` that returns the `(y, x)` 
+    pixel slices of `geobox` covering the bounds of each polygon in 
+    `gdf`, keyed by the polygon's index. Polygons entirely outside 
+    `geobox` are left out.
+    """
+
+    height, width = geobox.shape
+    inverse_affine = ~geobox.affine
+    windows = {}
+    for index, (minx, miny, maxx, maxy) in gdf.bounds.iterrows():
+        cols, rows = zip(*[inverse_affine * corner for corner in 
+                           [(minx, miny), (minx, maxy), 
+                            (maxx, miny), (maxx, maxy)]])
+        y_slice = slice(max(int(np.floor(min(rows))), 0),
+                        min(int(np.ceil(max(rows))), height))
+        x_slice = slice(max(int(np.floor(min(cols))), 0),
+                        min(int(np.ceil(max(cols))), width))
+        if y_slice.start < y_slice.stop and x_slice.start < x_slice.stop:
+            windows[index] = (y_slice, x_slice)
+
+    return windows
+
+
+def _mask_polygon(ds, inside, min_gooddata, preserve_dtype):
+    """
+    Helper function for `load_ard_polygons` that masks out pixels of 
+    `ds` outside a polygon (given by the boolean `inside` array), and 
+    drops observations with less than `min_gooddata` proportion of 
+    valid (unmasked) pixels inside the polygon.
+    """
+
+    # Identify valid pixels using the first spatial band
+    band = next(var for var in ds.data_vars.values() 
+                if set(inside.dims) <= set(var.dims))
+    if 'nodata' in band.attrs and band.dtype.kind != 'f':
+        valid = band != band.attrs['nodata']
+    else:
+        valid = band.notnull()
+
+    # Compute proportion of valid pixels inside the polygon
+    data_perc = ((valid & inside).sum(dim=inside.dims) / 
+                 max(int(inside.sum()), 1))
+    ds = ds.sel(time=data_perc >= min_gooddata)
+
+    # Mask out pixels outside the polygon, setting them to nodata (if 
+    # `preserve_dtype=True`) or NaN
+    masked_ds = ds.copy()
+    for var_name, var in ds.data_vars.items():
+        if not set(inside.dims) <= set(var.dims):
+            continue
+        if preserve_dtype and 'nodata' in var.attrs:
+            nodata = np.array(var.attrs['nodata'], dtype=var.dtype)
+            masked_ds[var_name] = (var.where(inside, nodata)
+                                   .assign_attrs(var.attrs))
+        else:
+            masked_ds[var_name] = (var.where(inside)
+                                   .assign_attrs(var.attrs))
+
+    return masked_ds
+
+
+def _quicklook_kwargs(dc, products, dcload_kwargs, quicklook_size):
+    """
+    Helper function for `load_ard` that returns a copy of a `dc.load` 
+    query that loads data onto a coarser version of the query's pixel 
+    grid, with a width and height no larger than `quicklook_size`. 
+    Bands are resampled using 'average' and fmask using 'nearest'.
+    """
+
+    geobox = _query_geobox(dc, products, dcload_kwargs)
+    factor = int(np.ceil(max(geobox.shape) / quicklook_size))
+    if factor <= 1:
+        return dcload_kwargs
+
+    height, width = (int(np.ceil(size / factor)) for size in geobox.shape)
+    print(f'Loading quick-look at {factor}x coarser resolution '
+          f'({height} x {width} pixels)')
+    quicklook_geobox = GeoBox(width, height, 
+                              geobox.affine * Affine.scale(factor), 
+                              geobox.crs)
+
+    # Spatial query parameters are replaced by a `like` geobox
+    quicklook_kwargs = {key: value for key, value in dcload_kwargs.items() 
+                        if key not in ('x', 'y', 'lon', 'lat', 'longitude',
+                                       'latitude', 'crs', 'geopolygon',
+                                       'output_crs', 'resolution', 
+                                       'align', 'like')}
+    quicklook_kwargs['like'] = quicklook_geobox
+    quicklook_kwargs.setdefault('resampling', {'*': 'average', 
+                                               'fmask': 'nearest', 
+                                               'oa_fmask': 'nearest'})
+    return quicklook_kwargs
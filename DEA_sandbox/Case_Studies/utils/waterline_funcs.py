@@ -8,7 +8,11 @@ Author: Robbi Bishop-Taylor
 
 """
 
+import os
+import glob
+import hashlib
 import xarray as xr
+import pandas as pd
 import affine
 import fiona
 import collections
@@ -22,13 +26,75 @@ from shapely.geometry import MultiLineString, mapping
 import matplotlib as mpl
 import matplotlib.cm
 import matplotlib.colors
-from otps import TimePoint
-from otps import predict_tide
 from datacube.utils.geometry import CRS
 from ipyleaflet import Map, Marker, Popup, GeoJSON, basemaps
-
-
-def tidal_tag(ds, tidepost_lat=None, tidepost_lon=None, swap_dims=False):
+from utils.dea_datahandling import _merge_by_time
+
+# The OTPS tide model is only needed if tide heights are not available from
+# the tide height tables in `data/tide_heights`
+try:
+    from otps import TimePoint
+    from otps import predict_tide
+except ImportError:
+    TimePoint = predict_tide = None
+
+# Default location of tide height tables (`{name}_{lat}_{lon}_tides.csv`)
+TIDE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+                        os.pardir, 'data', 'tide_heights')
+
+# Default location of binary copies of tide height tables, in the user's
+# cache directory
+TIDE_TABLE_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', 
+                                                   os.path.expanduser('~/.cache')), 
+                                    'dea-notebooks', 'tide_heights')
+
+
+def tidal_tag(ds, tidepost_lat=None, tidepost_lon=None, swap_dims=False,
+              tide_file=None, tide_dir=TIDE_DIR, tidepost_tolerance=0.1,
+              tide_cache_dir=None):
+    
+    """
+    Adds a `tide_height` variable giving the tide height at the time of 
+    each observation in an xarray dataset. Tide heights are interpolated
+    from a tide height table (see `interpolate_tides`) if one is given
+    using `tide_file`, or if a table is available in `tide_dir` for a 
+    tide post within `tidepost_tolerance` degrees of the tide modelling 
+    location. Otherwise, tide heights are modelled using OTPS, 
+    optionally reusing tide heights modelled in previous runs.
+    
+    Last modified: October 2026
+    Author: Robbi Bishop-Taylor
+    
+    Parameters
+    ----------
+    ds : xarray Dataset
+        An xarray dataset with a `time` dimension and `extent` attribute.
+    tidepost_lat, tidepost_lon : float, optional
+        The location used to model tides. Defaults to the dataset 
+        centroid.
+    swap_dims : bool, optional
+        Whether to make tide height the primary dimension instead of 
+        time, sorting the dataset by tide height. Defaults to False.
+    tide_file : str, optional
+        An optional path to a tide height table to use.
+    tide_dir : str, optional
+        The directory to search for tide height tables if `tide_file` is
+        not given. Defaults to the `data/tide_heights` directory.
+    tidepost_tolerance : float, optional
+        The maximum distance in degrees of latitude and longitude 
+        between the tide modelling location and a tide post in 
+        `tide_dir` for its table to be used. Defaults to 0.1.
+    tide_cache_dir : str, optional
+        An optional directory used to cache tide heights modelled using 
+        OTPS between runs, by tide modelling location (rounded to 3 
+        decimal places) and time. Only times that are not already in 
+        the cache are modelled. Defaults to None, which disables caching.
+        
+    Returns
+    -------
+    The input dataset with an added `tide_height` variable.
+    
+    """
     
     if not tidepost_lat or not tidepost_lon:
 
@@ -38,14 +104,36 @@ def tidal_tag(ds, tidepost_lat=None, tidepost_lon=None, swap_dims=False):
     else:
         print(f'Using user-supplied tide modelling location: {tidepost_lon}, {tidepost_lat}')
 
-    # Use the tidal mode to compute tide heights for each observation:
-    obs_datetimes = ds.time.data.astype('M8[s]').astype('O').tolist()
-    obs_timepoints = [TimePoint(tidepost_lon, tidepost_lat, dt) for dt in obs_datetimes]
-    obs_predictedtides = predict_tide(obs_timepoints)
+    # Interpolate tide heights from a tide height table if one is available
+    # for the tide modelling location and covers all observations
+    obs_tideheights = None
+    if tide_file is None:
+        tide_file = _find_tide_file(tidepost_lon, tidepost_lat, tide_dir, 
+                                    tidepost_tolerance)
+    if tide_file is not None:
+        obs_tideheights = interpolate_tides(ds.time.values, tide_file)
+        if np.isnan(obs_tideheights).any():
+            print(f'Observations outside the time range of {tide_file}; '
+                  f'modelling tides using OTPS')
+            obs_tideheights = None
+        else:
+            print(f'Using tide heights from {tide_file}')
+
+    if obs_tideheights is None:
+
+        if predict_tide is None:
+            raise ValueError(f'No tide height table is available for {tidepost_lon}, '
+                             f'{tidepost_lat}, and the OTPS tide model is not installed. '
+                             f'Please provide a tide height table using `tide_file`.')
+
+        # Use the tidal model to compute tide heights for each observation, 
+        # optionally reusing cached tide heights
+        obs_tideheights = _model_tides(ds.time.values, tidepost_lon, tidepost_lat, 
+                                       tide_cache_dir)
 
     # If tides cannot be successfully modeled (e.g. if the centre of the xarray dataset 
     # is located is over land), raise an exception 
-    if len(obs_predictedtides) == 0:
+    if obs_tideheights is None:
 
         raise ValueError(f'Tides could not be modelled for dataset centroid located at '
                          f'{tidepost_lon}, {tidepost_lat}. This can happen if this coordinate '
@@ -54,9 +142,6 @@ def tidal_tag(ds, tidepost_lat=None, tidepost_lon=None, swap_dims=False):
 
     else:
 
-        # Extract tide heights
-        obs_tideheights = [predictedtide.tide_m for predictedtide in obs_predictedtides]
-
         # Assign tide heights to the dataset as a new variable
         ds['tide_height'] = xr.DataArray(obs_tideheights, [('time', ds.time)])
 
@@ -70,6 +155,180 @@ def tidal_tag(ds, tidepost_lat=None, tidepost_lon=None, swap_dims=False):
         return ds
 
 
+def tide_binned_composites(ds, bin_edges=None, n_bins=9, reducer='median',
+                           output_dir=None):
+    
+    """
+    Combines a tide-tagged time series (e.g. from `tidal_tag`) into 
+    composite images for a set of tide height intervals, for example 
+    to map the intertidal zone using the waterline at each tide height. 
+    Observations are assigned to intervals using their `tide_height` 
+    (in the same way as `pd.cut(..., include_lowest=True)`), and each 
+    interval is then reduced over time by selecting only its own 
+    observations, rather than copying the entire time series for each
+    interval using `groupby`. Works on both numpy and lazy (dask) 
+    datasets; dask datasets are returned lazily, so all intervals are 
+    computed in a single pass over the data.
+    
+    Last modified: October 2026
+    
+    Parameters
+    ----------
+    ds : xarray Dataset
+        A dataset with a `time` dimension and a `tide_height` variable.
+    bin_edges : array-like, optional
+        Tide heights giving the edges of each tide interval. Defaults to
+        `n_bins` intervals containing equal numbers of observations 
+        (i.e. quantiles of tide height).
+    n_bins : int, optional
+        The number of tide intervals if `bin_edges` is not given. 
+        Defaults to 9.
+    reducer : str or function, optional
+        The name of the xarray reduction used to combine observations 
+        in each interval (e.g. 'median', 'mean', 'max'), or a function 
+        accepting an `axis` argument (e.g. `np.nanpercentile` wrapped 
+        using `functools.partial`). Defaults to 'median'.
+    output_dir : str, optional
+        An optional directory to write each tide interval to as a 
+        separate NetCDF file (`tide_interval_{n}.nc`) as soon as it is 
+        computed, so only one interval is held in memory at a time. The 
+        files are then opened lazily as a single dataset.
+        
+    Returns
+    -------
+    An xarray dataset with a `tide_interval` dimension (numbered from 1 
+    for the lowest interval) giving the composite of every spatial 
+    variable for each interval, along with the `tide_height` (median), 
+    `tide_min`, `tide_max` and `obs_count` of the observations in each 
+    interval. Intervals with no observations are skipped.
+    
+    """
+    
+    if 'tide_height' not in ds:
+        raise ValueError('`ds` has no `tide_height` variable; please run '
+                         '`tidal_tag` first')
+    
+    tide_heights = ds.tide_height.values
+    if bin_edges is None:
+        bin_edges = np.quantile(tide_heights, np.linspace(0, 1.0, n_bins + 1))
+    bin_edges = np.asarray(bin_edges)
+    
+    # Assign each observation to a right-closed tide interval, including
+    # observations equal to the lowest edge in the first interval
+    bin_ids = np.searchsorted(bin_edges, tide_heights, side='left')
+    bin_ids[tide_heights == bin_edges[0]] = 1
+    
+    # Composite all numeric spatial variables with a time dimension
+    spatial_vars = [name for name, var in ds.data_vars.items() 
+                    if 'time' in var.dims and var.ndim > 1 and 
+                    np.issubdtype(var.dtype, np.number)]
+    
+    bin_results = []
+    for interval in range(1, len(bin_edges)):
+        
+        indices = np.flatnonzero(bin_ids == interval)
+        if len(indices) == 0:
+            print(f'Skipping tide interval {interval}; no observations')
+            continue
+        
+        # Select only this interval's observations, with time in a single 
+        # dask chunk so that reductions like median can be applied per chunk
+        bin_ds = ds[spatial_vars].isel(time=indices)
+        if bin_ds.chunks:
+            bin_ds = bin_ds.chunk({'time': -1})
+        
+        if callable(reducer):
+            composite = bin_ds.reduce(reducer, dim='time')
+        else:
+            composite = getattr(bin_ds, reducer)(dim='time')
+        
+        # Add tide statistics for the interval
+        bin_tides = tide_heights[indices]
+        composite['tide_height'] = np.median(bin_tides)
+        composite['tide_min'] = bin_tides.min()
+        composite['tide_max'] = bin_tides.max()
+        composite['obs_count'] = len(indices)
+        composite = (composite.expand_dims('tide_interval')
+                     .assign_coords(tide_interval=[interval]))
+        
+        # Optionally compute and write the interval to disk straight away
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            bin_path = os.path.join(output_dir, f'tide_interval_{interval}.nc')
+            composite.attrs = {key: value if isinstance(value, (str, int, float, np.number))
+                               else str(value) for key, value in ds.attrs.items()}
+            composite.to_netcdf(bin_path)
+            bin_results.append(bin_path)
+            
+        else:
+            bin_results.append(composite)
+    
+    if output_dir:
+        return xr.open_mfdataset(bin_results, combine='nested', 
+                                 concat_dim='tide_interval')
+    
+    intervals_ds = xr.concat(bin_results, dim='tide_interval')
+    intervals_ds.attrs = ds.attrs
+    return intervals_ds
+
+
+def interpolate_tides(times, tide_file, cache_dir=TIDE_TABLE_CACHE_DIR):
+    
+    """
+    Interpolates tide heights for any number of times from a tide height 
+    table: a CSV file with `time` (UTC) and `tide_height` columns, like 
+    those in the `data/tide_heights` directory. The first time a table 
+    is used, it is converted to a compact binary `.npy` file in 
+    `cache_dir`, which is then memory-mapped so that only the parts of 
+    the table needed for the requested times are read from disk. If the 
+    binary file cannot be written, the CSV is read directly instead. 
+    All times are interpolated in a single vectorised operation.
+    
+    Last modified: October 2026
+    
+    Parameters
+    ----------
+    times : array-like
+        An array of times (e.g. `ds.time.values`) to interpolate tide 
+        heights for.
+    tide_file : str
+        Path to a tide height CSV file.
+    cache_dir : str, optional
+        The directory to write binary copies of tide height tables to. 
+        Defaults to `dea-notebooks/tide_heights` in the user's cache 
+        directory (e.g. `~/.cache`).
+        
+    Returns
+    -------
+    A numpy array of tide heights for each time, linearly interpolated 
+    between the two nearest times in the table. Times outside the range 
+    of the table are given NaN.
+    
+    """
+    
+    table = _tide_table(tide_file, cache_dir)
+    table_times = table['time']
+    table_heights = table['tide_height']
+    obs_times = np.asarray(times, dtype='datetime64[s]').astype('int64')
+
+    # Find the table rows before and after each time, reading only these
+    # rows from the memory-mapped table
+    after = np.clip(np.searchsorted(table_times, obs_times), 1, 
+                    len(table_times) - 1)
+    before = after - 1
+    time_before, time_after = table_times[before], table_times[after]
+    height_before = table_heights[before].astype(np.float64)
+    height_after = table_heights[after].astype(np.float64)
+
+    # Linearly interpolate between rows, setting times outside table to NaN
+    weight = (obs_times - time_before) / (time_after - time_before)
+    tide_heights = height_before + weight * (height_after - height_before)
+    outside = (obs_times < table_times[0]) | (obs_times > table_times[-1])
+    tide_heights[outside] = np.nan
+
+    return tide_heights
+
+
 def load_cloudmaskedlandsat(dc, query, platforms=['ls5t', 'ls7e', 'ls8c'], 
                             bands=['nbart_red', 'nbart_green', 'nbart_blue', 
                                    'nbart_nir', 'nbart_swir_1', 'nbart_swir_2'],
@@ -151,7 +410,7 @@ def load_cloudmaskedlandsat(dc, query, platforms=['ls5t', 'ls7e', 'ls8c'],
 
         platform_data.append(landsat_ds)
 
-    return xr.concat(platform_data, dim='time').sortby('time')
+    return _merge_by_time(platform_data)
     
      
 def contour_extract(ds_array, z_values, ds_crs, ds_affine, output_shp, min_vertices=2,
@@ -817,4 +1076,126 @@ def contours_to_arrays(gdf, col):
 
     return np.concatenate(coords_zvals)
 
+
+def _tide_table(tide_file, cache_dir):
+    
+    """
+    Helper function for `interpolate_tides` that returns a memory-mapped 
+    structured array of times (in seconds since 1970) and tide heights 
+    from a tide height CSV, converting the CSV to a binary `.npy` file 
+    in `cache_dir` the first time it is used (or if the CSV has since 
+    been modified). If the binary file cannot be written, the table 
+    read from the CSV is returned in memory instead.
+    """
+    
+    # Name binary files by the full path of the CSV, so tables with the
+    # same name in different directories do not overwrite each other
+    tide_file = os.path.abspath(tide_file)
+    path_hash = hashlib.md5(tide_file.encode()).hexdigest()[:8]
+    binary_file = os.path.join(cache_dir, 
+                               f'{os.path.splitext(os.path.basename(tide_file))[0]}'
+                               f'_{path_hash}.npy')
+    
+    if (os.path.exists(binary_file) and 
+        os.path.getmtime(binary_file) >= os.path.getmtime(tide_file)):
+        return np.load(binary_file, mmap_mode='r')
+        
+    tide_df = pd.read_csv(tide_file, parse_dates=['time']).sort_values('time')
+    table = np.empty(len(tide_df), dtype=[('time', 'int64'), 
+                                          ('tide_height', 'float32')])
+    table['time'] = tide_df.time.values.astype('datetime64[s]').astype('int64')
+    table['tide_height'] = tide_df.tide_height.values
+
+    # Write to a temporary file first so a partially written file is never read
+    temp_file = f'{binary_file}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(temp_file, 'wb') as f:
+            np.save(f, table)
+        os.replace(temp_file, binary_file)
+    except OSError:
+        print(f'Could not write binary tide height table to {cache_dir}; '
+              f'reading {tide_file} directly')
+        return table
+    
+    return np.load(binary_file, mmap_mode='r')
+
+
+def _find_tide_file(lon, lat, tide_dir, tolerance):
+    
+    """
+    Helper function for `tidal_tag` that returns the tide height table 
+    in `tide_dir` (named `{name}_{lat}_{lon}_tides.csv`) for the tide 
+    post nearest to `lon` and `lat`, or None if there is no tide post 
+    within `tolerance` degrees.
+    """
+    
+    nearest_file, nearest_distance = None, None
+    
+    for tide_file in glob.glob(os.path.join(tide_dir, '*_tides.csv')):
+        
+        try:
+            file_lat, file_lon = map(float, os.path.basename(tide_file)
+                                     .rsplit('_', 3)[1:3])
+        except ValueError:
+            continue
             
+        distance = max(abs(file_lat - lat), abs(file_lon - lon))
+        if distance <= tolerance and (nearest_distance is None or 
+                                      distance < nearest_distance):
+            nearest_file, nearest_distance = tide_file, distance
+            
+    return nearest_file
+
+
+def _model_tides(times, lon, lat, cache_dir=None):
+    
+    """
+    Helper function for `tidal_tag` that models tide heights for `times` 
+    at `lon` and `lat` using OTPS in a single call, returning None if 
+    tides could not be modelled. If `cache_dir` is given, tide heights 
+    are cached on disk by location (rounded to 3 decimal places) and 
+    time, and only times missing from the cache are modelled.
+    """
+    
+    obs_times = np.asarray(times, dtype='datetime64[s]').astype('int64')
+    cache = np.empty(0, dtype=[('time', 'int64'), ('tide_height', 'float64')])
+    cache_file = None
+    
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, f'tides_{lon:.3f}_{lat:.3f}.npy')
+        if os.path.exists(cache_file):
+            cache = np.load(cache_file)
+    
+    # Identify times that are not in the (sorted) cache
+    in_cache = np.zeros(len(obs_times), dtype=bool)
+    if len(cache) > 0:
+        cache_index = np.minimum(np.searchsorted(cache['time'], obs_times), 
+                                 len(cache) - 1)
+        in_cache = cache['time'][cache_index] == obs_times
+    missing_times = np.unique(obs_times[~in_cache])
+    
+    # Model all missing times in one call, and add them to the cache
+    if len(missing_times) > 0:
+        
+        missing_datetimes = missing_times.astype('datetime64[s]').astype('O').tolist()
+        obs_timepoints = [TimePoint(lon, lat, dt) for dt in missing_datetimes]
+        obs_predictedtides = predict_tide(obs_timepoints)
+        
+        if len(obs_predictedtides) == 0:
+            return None
+        
+        modelled = np.empty(len(missing_times), dtype=cache.dtype)
+        modelled['time'] = missing_times
+        modelled['tide_height'] = [predictedtide.tide_m for predictedtide 
+                                   in obs_predictedtides]
+        cache = np.sort(np.concatenate([cache, modelled]), order='time')
+        
+        if cache_file:
+            os.makedirs(cache_dir, exist_ok=True)
+            temp_file = f'{cache_file}.tmp'
+            with open(temp_file, 'wb') as f:
+                np.save(f, cache)
+            os.replace(temp_file, cache_file)
+    
+    return cache['tide_height'][np.searchsorted(cache['time'], obs_times)]